@@ -1,36 +1,143 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import atexit
+import cProfile
+import collections
+import concurrent.futures
+import contextlib
+import csv
 import datetime
+import functools
+import glob
+import hashlib
+import heapq
+import http.server
+import io
+import itertools
 import json
 import os
+import pstats
 from pipes import quote
+import queue
+import random
 import re
 import shutil
+import socketserver
+import struct
 import subprocess
+import sys
+import tempfile
+import threading
 import time
+import tracemalloc
+import urllib.parse
 import uuid
+import weakref
+import zlib
+import httpx
 import logging
+import logging.handlers
+import math
+import mmap
 from scholarly import scholarly, ProxyGenerator
 
 expander_recommended_version = "1.0.3"
 
 
-def configure_logging():
-    """Configure logging settings."""
-    log_file = 'script.log'
-    logging.basicConfig(level=logging.INFO,
-                        format='%(asctime)s - %(levelname)s - %(message)s')
-    logger = logging.getLogger(__name__)
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.INFO)
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(file_formatter)
-    logger.addHandler(file_handler)
+LOG_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sample"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; values passed with `extra=` become fields."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in LOG_RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Let through at most one record per `interval` seconds for each `extra={"sample": key}`.
+
+    Records without a sample key always pass; the first record after a quiet period reports how many
+    were dropped in between as `suppressed`.
+    """
+
+    def __init__(self, interval):
+        super().__init__()
+        self.interval = interval
+        self.last = {}
+        self.suppressed = collections.Counter()
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None or self.interval <= 0:
+            return True
+        now = time.monotonic()
+        if now - self.last.get(key, -math.inf) < self.interval:
+            self.suppressed[key] += 1
+            return False
+        self.last[key] = now
+        if self.suppressed[key]:
+            record.suppressed = self.suppressed.pop(key)
+        return True
+
+
+log_listener = None
+
+
+def configure_logging(args=None):
+    """Log to stderr (text) and a rotating log file (JSON lines by default) through a background queue.
+
+    Callers only pay for enqueueing a record; formatting and file I/O happen on the listener thread.
+    Handlers are attached to this module's logger only, so each record is emitted once per handler.
+    """
+    global log_listener
+    log_file = getattr(args, "log_file", "script.log")
+    stop_logging()
+    text_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(text_formatter)
+    handlers = [console_handler]
+    if log_file and log_file != "-":
+        if getattr(args, "log_rotate_when", None):
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                log_file, when=args.log_rotate_when, backupCount=args.log_backups, encoding="utf-8")
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=getattr(args, "log_max_bytes", 10 * 2**20),
+                backupCount=getattr(args, "log_backups", 5), encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter() if getattr(args, "log_format", "json") == "json" else text_formatter)
+        handlers.append(file_handler)
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(SamplingFilter(getattr(args, "log_sample_interval", 10.0)))
+    logger = logging.getLogger("scholarly_cli")
+    logger.setLevel(getattr(args, "log_level", "INFO"))
+    logger.handlers[:] = [queue_handler]
+    logger.propagate = False
+    log_listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    log_listener.start()
     return logger
 
 
-logger = configure_logging()
+@atexit.register
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+
+logger = logging.getLogger("scholarly_cli")
 
 
 def gettime():
@@ -41,16 +148,67 @@ def timestamp(text):
     logger.info(text)
 
 
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser()
+    parser.add_argument('--log-file', type=str, default='script.log',
+                        help='Log file for this run, "-" for none (default=script.log)')
+    parser.add_argument('--log-format', type=str, choices=["json", "text"], default="json",
+                        help='Log file format: JSON lines or plain text (default=json)')
+    parser.add_argument('--log-level', type=str, choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO",
+                        help='Minimum level logged (default=INFO)')
+    parser.add_argument('--log-max-bytes', type=int, default=10 * 2**20,
+                        help='Rotate the log file when it reaches this size (default=10 MiB)')
+    parser.add_argument('--log-rotate-when', type=str,
+                        help='Rotate the log file by time instead of size, e.g. midnight, H or D (see TimedRotatingFileHandler)')
+    parser.add_argument('--log-backups', type=int, default=5,
+                        help='Number of rotated log files kept (default=5)')
+    parser.add_argument('--log-sample-interval', type=float, default=10.0,
+                        help='Log high-frequency events (per-item errors) at most once per this many seconds each, 0 for all (default=10)')
     subparsers = parser.add_subparsers(dest='command')
 
-    search_parser = subparsers.add_parser('search', help='Search')
+    # Connection pool settings shared by every command that talks to Google Scholar.
+    http_parser = argparse.ArgumentParser(add_help=False)
+    http_parser.add_argument('--pool-size', type=int, default=10,
+                        help='Maximum number of pooled (kept-alive) connections per session (default=10)')
+    http_parser.add_argument('--keepalive', type=float, default=60.0,
+                        help='Seconds an idle pooled connection is kept open for reuse (default=60)')
+    http_parser.add_argument('--http-timeout', type=float, default=30.0,
+                        help='Default connect/read timeout in seconds for scholarly requests (default=30)')
+    http_parser.add_argument('--proxy-refresh', type=float, default=300.0,
+                        help='With free proxies, revalidate the saved proxy list in the background every N seconds (default=300, 0 to disable)')
+    http_parser.add_argument('--page-timeout', type=float, default=300.0,
+                        help='Give up on a result page after this many seconds, including scholarly\'s own retries (default=300, 0 for none)')
+    http_parser.add_argument('--fill-timeout', type=float, default=300.0,
+                        help='Deadline in seconds for each page fetched while filling a result (default=300, 0 for none)')
+    http_parser.add_argument('--count-timeout', type=float, default=120.0,
+                        help='Deadline in seconds for the initial count request (default=120, 0 for none)')
+    http_parser.add_argument('--request-retries', type=int, default=2,
+                        help='Retries, on a fresh session, after a request misses its deadline (default=2)')
+
+    cassette_parser = argparse.ArgumentParser(add_help=False)
+    cassette_parser.add_argument('--record', type=str, metavar='DIR',
+                        help='Record every page fetched through scholarly into an indexed archive in DIR')
+    cassette_parser.add_argument('--replay', type=str, metavar='DIR',
+                        help='Serve pages from an archive made with --record instead of the network (no proxy is set up)')
+
+    search_parser = subparsers.add_parser('search', help='Search', parents=[http_parser, cassette_parser])
     search_parser.add_argument('search', type=str, nargs='+', help='Search query')
     search_parser.add_argument('--limit', type=int, default=20,
                         help='Number of results to retrieve (default=20)')
+    search_parser.add_argument('--sample', type=int,
+                        help='Instead of the top --limit results, take a stratified random sample of this many results spread across the ranking (Scholar serves the first 1000); the plan is recorded in the metadata')
+    search_parser.add_argument('--seed', type=int,
+                        help='Random seed for --sample (default: random, recorded in the metadata)')
     search_parser.add_argument('--count', action='store_true',
                         help='Only count the number of results without processing them')
+    search_parser.add_argument('--histogram', action='store_true',
+                        help='With --count, also count results per year (or per --bucket years) of the --date range, appending the rows to the .tsv')
+    search_parser.add_argument('--bucket', type=int, default=1,
+                        help='Years per --histogram bucket (default=1)')
+    search_parser.add_argument('--count-workers', type=int, default=4,
+                        help='Number of --histogram count requests running in parallel (default=4)')
+    search_parser.add_argument('--count-rate', type=float, default=1.0,
+                        help='Maximum --histogram count requests started per second (default=1.0, 0 for no limit)')
     search_parser.add_argument('--patents', type=bool, default=False,
                         help='Include patents in the search results.')
     search_parser.add_argument('--citations', type=bool, default=False,
@@ -68,8 +226,16 @@ def parse_arguments():
                         help='Output individual json files, one per result (default=False).')
     search_parser.add_argument('--bibtex', action='store_true',
                         help='Output bibtex (default=False).')
+    search_parser.add_argument('--format', type=str, choices=sorted(EXPORT_FORMATS),
+                        help='Also write each output file as CSL-JSON (csl), RIS (ris) or CSV (csv)')
     search_parser.add_argument('--fill', action='store_true',
                         help='Fill results; requires extra queries (default=False).')
+    search_parser.add_argument('--fill-when', type=str,
+                        help='With --fill, only fill results meeting one of these comma-separated conditions: truncated (abstract cut off), missing (year or venue missing), cited (at least --fill-min-citations citations). Default: fill all results.')
+    search_parser.add_argument('--fill-min-citations', type=int, default=10,
+                        help='Citation threshold for --fill-when cited (default=10)')
+    search_parser.add_argument('--fill-budget', type=int,
+                        help='With --fill, fill at most this many results per run, most cited first (ranked per chunk when --chunksize is used)')
     search_parser.add_argument(
         '--save', type=str, help='Output file name without extension - otherwise the search query will be used')
     search_parser.add_argument('--time', action='store_true',
@@ -78,6 +244,30 @@ def parse_arguments():
                         help='Test the length of the search query against common URL length limits')
     search_parser.add_argument('--chunksize', type=int,
                         help='Number of items per chunk')
+    search_parser.add_argument('--fields', type=str,
+                        help='Comma-separated fields to keep for each result, e.g. title,year,venue,abstract,pub_url,num_citations (default: keep the full record)')
+    search_parser.add_argument('--engine', type=str, choices=["sync", "async"], default="sync",
+                        help='sync: page after page through scholarly (default); async: fetch result pages (and fills) concurrently with asyncio')
+    search_parser.add_argument('--concurrency', type=int, default=4,
+                        help='With --engine async, maximum result pages in flight (default=4)')
+    search_parser.add_argument('--fill-concurrency', type=int, default=4,
+                        help='With --engine async, maximum fills in flight (default=4)')
+    search_parser.add_argument('--prefetch', type=int, default=0,
+                        help='Number of result pages to fetch ahead in the background while the current page is processed (default=0, no prefetch)')
+    search_parser.add_argument('--status-file', type=str,
+                        help='Keep a machine-readable status (stage, rate, ETA, errors, quota) in this json file, rewritten atomically')
+    search_parser.add_argument('--status-interval', type=float, default=2.0,
+                        help='Minimum seconds between rewrites of --status-file (default=2)')
+    search_parser.add_argument('--status-port', type=int,
+                        help='Serve the live status as json on http://127.0.0.1:PORT/status')
+    search_parser.add_argument('--log-interval', type=float, default=10.0,
+                        help='Minimum seconds between progress lines in the log (default=10)')
+    search_parser.add_argument('--stall-timeout', type=float, default=900.0,
+                        help='Watchdog: replace the HTTP sessions after this many seconds without progress, then checkpoint and stop if that does not help (default=900, 0 to disable)')
+    search_parser.add_argument('--max-runtime', type=float,
+                        help='Stop after this many seconds, writing the results retrieved so far')
+    search_parser.add_argument('--profile', action='store_true',
+                        help='Profile the run per phase (expansion, proxy, count, search, fill, write) with cProfile and tracemalloc; writes OUTPUT.profile/')
     search_parser.add_argument('--noexpansion', action='store_true', default=False,
                                help='If your search term contains ... or AND or uses more than one positional argument, search term expansion is triggered. Use --noexpansion to suppress expansion.')
     search_parser.add_argument('--anyversion', action='store_true', default=False,
@@ -85,35 +275,343 @@ def parse_arguments():
 
     subparsers.add_parser('config', help='Configure API key')
 
-    return parser.parse_args()
-
-
-
-def log_additional_info(page, progress, remaining_queries, total_results, items_per_page, start_time, quota_after_search_has_finished):
-    current_time = time.time()
-    time_elapsed = current_time - start_time
-    total_time_estimated = time_elapsed / \
-        (progress / 100) if progress > 0 else 0
-    time_remaining = total_time_estimated - time_elapsed
-    time_remaining_formatted = format_as_time(time_remaining)
-    estimated_completion_time = datetime.datetime.now(
-    ) + datetime.timedelta(seconds=time_remaining)
-    estimated_completion_time_iso = estimated_completion_time.isoformat()
-    info_string = (
-        f"Retrieving Item: {page}\n"
-        f"- Progress: {progress} %\n"
-        f"- Remaining duration: {time_remaining_formatted}\n"
-        f"- Estimated completion time: {estimated_completion_time_iso}\n"
-        f"- Query quota: {remaining_queries}\n"
-        f"- Query Quota remaining after search: {quota_after_search_has_finished}\n"
-    )
-    logger.info(info_string)
-
-    if quota_after_search_has_finished < 0:
+    fill_parser = subparsers.add_parser('fill', help='Fill the results in existing json result files', parents=[http_parser, cassette_parser])
+    fill_parser.add_argument('files', type=str, nargs='+', help='Result files written by search')
+    fill_parser.add_argument('--inplace', action='store_true',
+                        help='Update the input files in place (atomically) instead of writing FILE.filled.json')
+    fill_parser.add_argument('--outdir', type=str,
+                        help='Directory for the filled copies (default: next to the input files)')
+    fill_parser.add_argument('--workers', type=int, default=4,
+                        help='Number of fills running in parallel (default=4)')
+    fill_parser.add_argument('--rate', type=float, default=1.0,
+                        help='Maximum fill requests started per second across all workers (default=1.0, 0 for no limit)')
+    fill_parser.add_argument('--cache', type=str, default=os.path.expanduser("~/.cache/scholarly-cli/fill"),
+                        help='Directory caching filled publications by id (default=~/.cache/scholarly-cli/fill)')
+    fill_parser.add_argument('--checkpoint', type=int, default=20,
+                        help='Save the output file after every N fills so an interrupted run can resume (default=20)')
+    fill_parser.add_argument('--fill-when', type=str,
+                        help='Only fill results meeting one of these comma-separated conditions: truncated, missing, cited')
+    fill_parser.add_argument('--fill-min-citations', type=int, default=10,
+                        help='Citation threshold for --fill-when cited (default=10)')
+    fill_parser.add_argument('--fill-budget', type=int,
+                        help='Fill at most this many results in this run, most cited first within each file')
+
+    download_parser = subparsers.add_parser('download', help='Download the eprints (full texts) linked from result files', parents=[http_parser])
+    download_parser.add_argument('files', type=str, nargs='+', help='Result files (json or jsonl); glob patterns are expanded')
+    download_parser.add_argument('--store', type=str, default='fulltext',
+                        help='Content-addressed store directory; files are saved by sha256 and listed in STORE/manifest.jsonl (default=fulltext)')
+    download_parser.add_argument('--workers', type=int, default=8,
+                        help='Number of downloads running in parallel (default=8)')
+    download_parser.add_argument('--per-host', type=int, default=2,
+                        help='Maximum parallel downloads from one host (default=2)')
+    download_parser.add_argument('--host-delay', type=float, default=1.0,
+                        help='Minimum seconds between request starts to one host (default=1)')
+    download_parser.add_argument('--retries', type=int, default=3,
+                        help='Retries per file with exponential backoff (default=3)')
+
+    dedupe_parser = subparsers.add_parser('dedupe', help='Find near-duplicate publications (MinHash/LSH over title, first author and year); requires numpy')
+    dedupe_parser.add_argument('files', type=str, nargs='+', help='Result files (json or jsonl); glob patterns are expanded')
+    dedupe_parser.add_argument('--output', '-o', type=str, required=True, help='Output json file with the duplicate clusters')
+    dedupe_parser.add_argument('--deduped', type=str,
+                        help='Also write the results with only the canonical record of each cluster to this json file')
+    dedupe_parser.add_argument('--threshold', type=float, default=0.7,
+                        help='Minimum estimated Jaccard similarity of character shingles to count as duplicates (default=0.7)')
+    dedupe_parser.add_argument('--num-perm', type=int, default=128,
+                        help='Number of MinHash permutations (default=128)')
+    dedupe_parser.add_argument('--bands', type=int, default=32,
+                        help='Number of LSH bands; must divide --num-perm (default=32)')
+
+    analyze_parser = subparsers.add_parser('analyze', help='Summarise result files: years, venues, citations and per-query overlap; requires numpy and scipy')
+    analyze_parser.add_argument('files', type=str, nargs='+', help='Result files (json or jsonl); glob patterns are expanded')
+    analyze_parser.add_argument('--outdir', type=str, default='analysis',
+                        help='Directory for report.json and the csv tables (default=analysis)')
+    analyze_parser.add_argument('--top', type=int, default=50,
+                        help='Number of venues in venues.csv (default=50)')
+
+    serve_parser = subparsers.add_parser('serve', help='Run a long-lived server with a warm proxy that accepts search/count/fill jobs', parents=[http_parser, cassette_parser])
+    serve_parser.add_argument('--port', type=int, default=8787,
+                        help='Listen on http://127.0.0.1:PORT (default=8787)')
+    serve_parser.add_argument('--socket', type=str,
+                        help='Listen on this Unix socket instead of a TCP port')
+    serve_parser.add_argument('--max-jobs', type=int, default=1,
+                        help='Number of jobs running at the same time; further jobs wait (default=1)')
+
+    get_parser = subparsers.add_parser('get', help='Look up a single publication in result files via their sidecar indexes')
+    get_parser.add_argument('key', type=str, help='Publication id (Scholar cluster id, url or title hash) or title')
+    get_parser.add_argument('files', type=str, nargs='*', help='Result files or glob patterns (default: *.json)')
+    get_parser.add_argument('--build', action='store_true', help='Index files that have no (current) sidecar index first')
+    get_parser.add_argument('--all', action='store_true', help='Print every match instead of the first one')
+
+    sweep_parser = subparsers.add_parser('sweep', help='Search every term of search term files, optionally coalescing them into fewer OR queries', parents=[http_parser, cassette_parser])
+    sweep_parser.add_argument('terms', type=str, nargs='+', help='Search term files; glob patterns are expanded')
+    sweep_parser.add_argument('--with', dest='with_terms', type=str,
+                        help='Query text added to every query, e.g. \'"early childhood" Kenya\'')
+    sweep_parser.add_argument('--date', type=str,
+                        help='Date range in format year_low-year_high, year, year- or -year.')
+    sweep_parser.add_argument('--limit', type=int, default=100,
+                        help='Number of results to retrieve per query (default=100)')
+    sweep_parser.add_argument('--coalesce', action='store_true',
+                        help='Merge terms into OR queries and attribute the results back to the terms by matching title and snippet')
+    sweep_parser.add_argument('--max-url-length', type=int, default=2048,
+                        help='Longest query url a coalesced query may produce (default=2048)')
+    sweep_parser.add_argument('--max-terms', type=int, default=20,
+                        help='Most terms OR-ed into one query (default=20)')
+    sweep_parser.add_argument('--save', type=str, default='sweep',
+                        help='Output file stem: writes STEM.json and the per-term report STEM.sweep.csv (default=sweep)')
+
+    rank_parser = subparsers.add_parser('rank', help='Prioritise results by their coverage of concept groups (search term files); requires numpy and scipy')
+    rank_parser.add_argument('files', type=str, nargs='+', help='Result files (json or jsonl); glob patterns are expanded')
+    rank_parser.add_argument('--terms', type=str, nargs='+', required=True,
+                        help='Search term files, one concept group each, e.g. searchterms/Geography.txt searchterms/Outcomes.txt')
+    rank_parser.add_argument('--scheme', type=str, choices=["bm25", "tfidf"], default="bm25",
+                        help='Term weighting of titles and abstracts (default=bm25)')
+    rank_parser.add_argument('--k1', type=float, default=1.2, help='BM25 term frequency saturation (default=1.2)')
+    rank_parser.add_argument('--b', type=float, default=0.75, help='BM25 length normalisation (default=0.75)')
+    rank_parser.add_argument('--top', type=int, help='Only write the N highest ranked publications')
+    rank_parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of files tokenised in parallel (default: number of CPUs)')
+    rank_parser.add_argument('-o', '--output', type=str, default='ranked.csv',
+                        help='Prioritised list (csv) to write (default=ranked.csv)')
+
+    export_parser = subparsers.add_parser('export', help='Convert result files to CSL-JSON, RIS or CSV')
+    export_parser.add_argument('files', type=str, nargs='+', help='Result files (json or jsonl); glob patterns are expanded')
+    export_parser.add_argument('--format', type=str, choices=sorted(EXPORT_FORMATS), required=True,
+                        help='Output format')
+    export_parser.add_argument('-o', '--output', type=str,
+                        help='Output file (default: export.csl.json, export.ris or export.csv)')
+    export_parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of files converted in parallel (default: number of CPUs)')
+
+    refresh_parser = subparsers.add_parser('refresh', help='Refresh citation counts in result files, most stale and most cited first', parents=[http_parser, cassette_parser])
+    refresh_parser.add_argument('files', type=str, nargs='+', help='Result files (json); glob patterns are expanded. Files are updated in place.')
+    refresh_parser.add_argument('--budget', type=int, default=100,
+                        help='Maximum number of records refreshed (one request each) in this run (default=100)')
+    refresh_parser.add_argument('--min-age', type=float, default=30,
+                        help='Only refresh counts older than this many days (default=30)')
+    refresh_parser.add_argument('--workers', type=int, default=4,
+                        help='Number of requests running in parallel (default=4)')
+    refresh_parser.add_argument('--rate', type=float, default=1.0,
+                        help='Maximum requests started per second across all workers (default=1.0, 0 for no limit)')
+
+    merge_parser = subparsers.add_parser('merge', help='Merge result files (e.g. all chunks of one or more runs) into one file')
+    merge_parser.add_argument('files', type=str, nargs='+', help='Result files (json or jsonl); glob patterns are expanded')
+    merge_parser.add_argument('--output', '-o', type=str, required=True, help='Output json file')
+    merge_parser.add_argument('--sort', type=str, choices=["year", "citations"],
+                        help='Sort the merged results (default: keep input order)')
+    merge_parser.add_argument('--order', type=str, choices=["asc", "desc"], default="desc",
+                        help='Sort order for --sort (default=desc)')
+    merge_parser.add_argument('--keep-duplicates', action='store_true',
+                        help='Do not drop results with a publication id seen before')
+    merge_parser.add_argument('--run-size', type=int, default=50000,
+                        help='Records held in memory before spilling a sorted run to disk (default=50000)')
+
+    queue_parser = subparsers.add_parser('queue', help='Manage a shared job queue directory for multi-node harvesting')
+    queue_subparsers = queue_parser.add_subparsers(dest='queue_command')
+    queue_add_parser = queue_subparsers.add_parser('add', help='Add a job, e.g. queue add [--shard-years N] DIR search "my query" --limit 100 (queue options go before DIR)')
+    queue_add_parser.add_argument('queue_dir', type=str, help='Shared queue directory')
+    queue_add_parser.add_argument('--shard-years', type=int,
+                        help='Split a search with --date year_low-year_high into one job per N years')
+    queue_add_parser.add_argument('--batch-size', type=int,
+                        help='Split a fill job into one job per N files')
+    queue_add_parser.add_argument('job', nargs=argparse.REMAINDER, help='Command line of the job, starting with the subcommand')
+    queue_status_parser = queue_subparsers.add_parser('status', help='Show job counts per state')
+    queue_status_parser.add_argument('queue_dir', type=str, help='Shared queue directory')
+    queue_merge_parser = queue_subparsers.add_parser('merge', help='Merge the per-job outputs into a single json file')
+    queue_merge_parser.add_argument('queue_dir', type=str, help='Shared queue directory')
+    queue_merge_parser.add_argument('--output', '-o', type=str, required=True, help='Output json file')
+
+    worker_parser = subparsers.add_parser('worker', help='Claim and run jobs from a shared queue directory')
+    worker_parser.add_argument('queue_dir', type=str, help='Shared queue directory')
+    worker_parser.add_argument('--lease', type=int, default=600,
+                        help='Seconds without a heartbeat after which a claimed job is reassigned (default=600)')
+    worker_parser.add_argument('--heartbeat', type=int, default=60,
+                        help='Seconds between heartbeats for the running job (default=60)')
+    worker_parser.add_argument('--max-attempts', type=int, default=3,
+                        help='Number of attempts before a job is moved to failed/ (default=3)')
+    worker_parser.add_argument('--poll', type=int, default=30,
+                        help='Seconds to wait before polling an empty queue again (default=30)')
+    worker_parser.add_argument('--exit-when-empty', action='store_true',
+                        help='Exit when no pending or leased jobs are left instead of polling')
+
+    return parser.parse_args(argv)
+
+
+
+class PhaseProfiler:
+    """cProfile stats, wall time and tracemalloc memory per phase of a run (only the calling thread is profiled)."""
+
+    def __init__(self, snapshot_interval=10.0):
+        self.profiles = {}
+        self.times = collections.Counter()
+        self.calls = collections.Counter()
+        self.peak_memory = {}
+        self.snapshots = {}
+        self.snapshot_times = {}
+        self.snapshot_interval = snapshot_interval
+        self.current = None
+        self.current_start = None
+        tracemalloc.start()
+
+    def switch(self, phase):
+        """End the current phase and start `phase` (None or "done" just ends the current one)."""
+        if self.current is not None:
+            self.profiles[self.current].disable()
+            self.times[self.current] += time.perf_counter() - self.current_start
+            self.calls[self.current] += 1
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak_memory[self.current] = max(self.peak_memory.get(self.current, 0), peak)
+            tracemalloc.reset_peak()
+            now = time.monotonic()
+            if now - self.snapshot_times.get(self.current, 0) >= self.snapshot_interval:
+                self.snapshots[self.current] = tracemalloc.take_snapshot()
+                self.snapshot_times[self.current] = now
+            self.current = None
+        if phase is not None and phase != "done":
+            self.current = phase
+            self.current_start = time.perf_counter()
+            self.profiles.setdefault(phase, cProfile.Profile()).enable()
+
+    def report(self, directory):
+        """Write PHASE.prof files (loadable with pstats/snakeviz) and summary.txt into `directory`."""
+        self.switch(None)
+        tracemalloc.stop()
+        os.makedirs(directory, exist_ok=True)
+        total = sum(self.times.values()) or 1
+        lines = ["phase\twall_seconds\tshare\tentries\tpeak_memory_kb"]
+        for phase, seconds in self.times.most_common():
+            lines.append(f"{phase}\t{seconds:.3f}\t{100 * seconds / total:.1f}%\t{self.calls[phase]}\t{self.peak_memory.get(phase, 0) // 1024}")
+        for phase, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(directory, f"{phase}.prof"))
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(15)
+            lines += ["", f"=== {phase}: top functions by cumulative time", stream.getvalue().strip()]
+            if phase in self.snapshots:
+                lines += ["", f"=== {phase}: top allocations (last snapshot)"]
+                lines += [str(stat) for stat in self.snapshots[phase].statistics('lineno')[:10]]
+        summary_filename = os.path.join(directory, "summary.txt")
+        with open(summary_filename, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        logger.info(f"Profile written to {summary_filename}")
+
+
+class ProgressTracker:
+    """Thread-safe run status: stage, counts, an EWMA-smoothed rate and the ETA derived from it."""
+
+    def __init__(self, total, quota=None, smoothing=30.0, profiler=None):
+        self.profiler = profiler
+        self.lock = threading.Lock()
+        self.total = total
+        self.quota = quota
+        self.smoothing = smoothing
+        self.stage = "starting"
+        self.items = 0
+        self.errors = 0
+        self.rate = None
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.last_items = 0
+        self.last_progress = time.monotonic()
+
+    def set_stage(self, stage):
+        with self.lock:
+            self.stage = stage
+            self.last_progress = time.monotonic()
+        if self.profiler is not None:
+            self.profiler.switch(stage)
+
+    def touch(self):
+        """Record progress that is not a retrieved item, e.g. a finished fill."""
+        with self.lock:
+            self.last_progress = time.monotonic()
+
+    def item_done(self, quota=None):
+        with self.lock:
+            self.items += 1
+            if quota is not None:
+                self.quota = quota
+            now = time.time()
+            dt = now - self.last_time
+            if dt > 0:
+                rate = (self.items - self.last_items) / dt
+                alpha = 1 - math.exp(-dt / self.smoothing)
+                self.rate = rate if self.rate is None else alpha * rate + (1 - alpha) * self.rate
+                self.last_time, self.last_items = now, self.items
+            self.last_progress = time.monotonic()
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            remaining = max(self.total - self.items, 0) if self.total else None
+            eta = remaining / self.rate if remaining is not None and self.rate else None
+            quota_after = self.quota - remaining if self.quota is not None and remaining is not None else None
+            return {
+                "pid": os.getpid(),
+                "stage": self.stage,
+                "items": self.items,
+                "total": self.total,
+                "progress": round(100 * self.items / self.total, 1) if self.total else None,
+                "items_per_second": round(self.rate, 3) if self.rate is not None else None,
+                "eta_seconds": round(eta) if eta is not None else None,
+                "estimated_completion": (datetime.datetime.now() + datetime.timedelta(seconds=eta)).isoformat() if eta is not None else None,
+                "errors": self.errors,
+                "quota": self.quota,
+                "quota_after_search": quota_after,
+                "elapsed_seconds": round(time.time() - self.start_time, 1),
+                "http": http_stats.summary(),
+                "updated": gettime(),
+            }
+
+
+def start_status_server(tracker, port):
+    """Serve the tracker snapshot as json on http://127.0.0.1:port/status from a daemon thread."""
+    class StatusHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/status"):
+                self.send_error(404)
+                return
+            body = json.dumps(tracker.snapshot()).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), StatusHandler)
+    threading.Thread(target=server.serve_forever, name="status-server", daemon=True).start()
+    logger.info(f"Status available at http://127.0.0.1:{server.server_address[1]}/status")
+    return server
+
+
+def log_additional_info(tracker):
+    status = tracker.snapshot()
+    eta = format_as_time(status["eta_seconds"]) if status["eta_seconds"] is not None else "unknown"
+    logger.info(f"Retrieved {status['items']}/{status['total']} ({status['progress']} %), "
+                f"{status['items_per_second'] or 0:.2f} items/s, remaining {eta}, "
+                f"completion {status['estimated_completion']}, quota {status['quota']}, errors {status['errors']}",
+                extra={"event": "progress", "status": status})
+
+    if status["quota_after_search"] is not None and status["quota_after_search"] < 0:
         logger.warning(
             "Warning: Query quota will be exhausted before search is finished.")
 
 
+def report_progress(tracker, args, state, force=False):
+    """Rate-limited progress reporting: rewrite --status-file and log one line every --log-interval seconds."""
+    now = time.monotonic()
+    if args.status_file and (force or now - state.get("status", 0) >= args.status_interval):
+        state["status"] = now
+        write_json_atomic(tracker.snapshot(), args.status_file)
+    if force or now - state.get("log", 0) >= args.log_interval:
+        state["log"] = now
+        log_additional_info(tracker)
+
+
 def format_as_time(seconds):
     """Formats time in seconds to a human-readable format."""
     hours, remainder = divmod(seconds, 3600)
@@ -140,7 +638,457 @@ def test_url_length(search_query):
         print("Warning: The full URL exceeds the typical maximum length of 2048 characters for URLs.")
 
 
+proxy_configured = False
+
+
+class HttpStats:
+    """Thread-safe counters for requests sent through the pooled scholarly sessions."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+        # Streams of live connections; a response on a stream not seen before means a new connection.
+        self.streams = weakref.WeakSet()
+
+    def on_response(self, response):
+        stream = response.extensions.get("network_stream")
+        with self.lock:
+            self.requests += 1
+            if response.status_code >= 400:
+                self.errors += 1
+            if stream is not None and stream not in self.streams:
+                self.streams.add(stream)
+                self.connections += 1
+
+    def summary(self):
+        with self.lock:
+            connections = self.connections
+            reused = max(self.requests - connections, 0)
+            return {
+                "requests": self.requests,
+                "connections": connections,
+                "reused": reused,
+                "reuse_rate": round(reused / self.requests, 3) if self.requests else None,
+                "http_errors": self.errors,
+            }
+
+
+http_stats = HttpStats()
+
+
+def http_session_options(args):
+    """httpx.Client options for pooled, kept-alive and instrumented connections."""
+    pool_size = getattr(args, 'pool_size', 10)
+    return {
+        "limits": httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                               keepalive_expiry=getattr(args, 'keepalive', 60.0)),
+        "timeout": httpx.Timeout(getattr(args, 'http_timeout', 30.0)),
+        "event_hooks": {"response": [http_stats.on_response]},
+    }
+
+
+def configure_http_sessions(args):
+    """Make scholarly's proxy generators build (and rebuild, e.g. after a captcha) tuned httpx sessions."""
+    if hasattr(scholarly, "set_timeout"):
+        # scholarly passes its own per-request timeout, which would override the session default.
+        scholarly.set_timeout(args.http_timeout)
+    nav = getattr(scholarly, "_Scholarly__nav", None)
+    generators = [getattr(nav, name, None) for name in ("pm1", "pm2")]
+    generators = [pg for i, pg in enumerate(generators) if pg is not None and pg not in generators[:i]]
+    if not generators or not all(hasattr(pg, "_new_session") for pg in generators):
+        logger.warning("This scholarly version does not expose its sessions; connection pool settings are not applied.")
+        return
+    options = http_session_options(args)
+    for pg in generators:
+        pg._new_session = functools.partial(pg._new_session, **options)
+        pg._new_session()
+    nav._session1 = nav.pm1.get_session()
+    nav._session2 = nav.pm2.get_session()
+
+
+class Cassette:
+    """Archive of scholarly page responses: zlib-compressed bodies appended to pages.bin, offsets in index.jsonl."""
+
+    def __init__(self, directory, mode):
+        self.directory = directory
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.entries = collections.defaultdict(list)
+        self.played = collections.Counter()
+        os.makedirs(directory, exist_ok=True)
+        self.pages_filename = os.path.join(directory, "pages.bin")
+        self.index_filename = os.path.join(directory, "index.jsonl")
+        if mode == "replay":
+            with open(self.index_filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.entries[entry["key"]].append((entry["offset"], entry["length"]))
+            with open(self.pages_filename, 'rb') as f:
+                self.pages = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.pages_filename) else b""
+        else:
+            self.pages = open(self.pages_filename, 'ab')
+            self.index = open(self.index_filename, 'a', encoding='utf-8')
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def record(self, url, body):
+        data = zlib.compress(body.encode('utf-8'))
+        with self.lock:
+            offset = self.pages.tell()
+            self.pages.write(data)
+            self.pages.flush()
+            self.index.write(json.dumps({"key": self.key(url), "url": url, "offset": offset,
+                                         "length": len(data), "time": gettime()}) + "\n")
+            self.index.flush()
+
+    def play(self, url):
+        """Return the recorded responses for `url` in recording order, repeating the last one."""
+        key = self.key(url)
+        with self.lock:
+            entries = self.entries.get(key)
+            if not entries:
+                raise Exception(f"No recorded response for {url} in {self.directory}")
+            offset, length = entries[min(self.played[key], len(entries) - 1)]
+            self.played[key] += 1
+        return zlib.decompress(self.pages[offset:offset + length]).decode('utf-8')
+
+
+def install_cassette(args):
+    """Route scholarly's page fetches through a --record or --replay cassette."""
+    nav = getattr(scholarly, "_Scholarly__nav", None)
+    if nav is None or not hasattr(nav, "_get_page"):
+        raise Exception("This scholarly version does not expose Navigator._get_page; --record/--replay are unavailable.")
+    if args.replay:
+        cassette = Cassette(args.replay, "replay")
+
+        def get_page(pagerequest, *page_args, **page_kwargs):
+            return cassette.play(pagerequest)
+        logger.info(f"Replaying scholarly responses from {args.replay}")
+    else:
+        cassette = Cassette(args.record, "record")
+        original_get_page = nav._get_page
+
+        def get_page(pagerequest, *page_args, **page_kwargs):
+            body = original_get_page(pagerequest, *page_args, **page_kwargs)
+            cassette.record(pagerequest, body)
+            return body
+        logger.info(f"Recording scholarly responses to {args.record}")
+    nav._get_page = get_page
+
+
+class RequestTimeout(TimeoutError):
+    pass
+
+
+# Per-kind deadlines (seconds, None for none) for one scholarly page fetch, including scholarly's own retries.
+request_timeouts = {"page": None, "fill": None, "count": None}
+request_retries = 2
+request_context = threading.local()
+
+
+@contextlib.contextmanager
+def request_kind(kind, timeout=None):
+    """Apply the `kind` deadline (or `timeout`) to the page fetches made by this thread in the block."""
+    previous = getattr(request_context, "kind", None)
+    request_context.kind = (kind, timeout if timeout is not None else request_timeouts.get(kind))
+    try:
+        yield
+    finally:
+        request_context.kind = previous
+
+
+def call_with_deadline(fn, timeout, *fn_args, **fn_kwargs):
+    """Run fn in a helper thread and give up on it (it keeps running, detached) after `timeout` seconds."""
+    outcome = {}
+
+    def target():
+        request_context.kind = ("nested", None)  # The deadline is already being enforced by the caller.
+        try:
+            outcome["value"] = fn(*fn_args, **fn_kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, name="request", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise RequestTimeout(f"no response within {timeout:g} seconds")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
+
+
+def reset_sessions():
+    """Replace scholarly's sessions, abandoning connections a timed-out request may still hold."""
+    nav = getattr(scholarly, "_Scholarly__nav", None)
+    generators = [getattr(nav, name, None) for name in ("pm1", "pm2")]
+    # With free proxies pm1 is pm2; renewing it twice would close the session just handed to _session1.
+    generators = [pg for i, pg in enumerate(generators) if pg is not None and pg not in generators[:i]]
+    if not generators or not all(hasattr(pg, "_new_session") for pg in generators):
+        return
+    for pg in generators:
+        try:
+            pg._new_session()
+        except Exception as e:
+            logger.warning(f"Could not replace the HTTP session: {e}")
+    nav.got_403 = False
+    nav._session1 = nav.pm1.get_session()
+    nav._session2 = nav.pm2.get_session()
+
+
+def install_request_deadlines(args):
+    """Enforce --page-timeout/--fill-timeout/--count-timeout on scholarly's page fetches, retrying on a fresh session."""
+    global request_retries
+    request_timeouts.update(page=getattr(args, 'page_timeout', None), fill=getattr(args, 'fill_timeout', None),
+                            count=getattr(args, 'count_timeout', None))
+    request_retries = getattr(args, 'request_retries', request_retries)
+    nav = getattr(scholarly, "_Scholarly__nav", None)
+    if nav is None or not hasattr(nav, "_get_page"):
+        logger.warning("This scholarly version does not expose Navigator._get_page; request timeouts are not applied.")
+        return
+    original_get_page = nav._get_page
+
+    def get_page(pagerequest, *page_args, **page_kwargs):
+        kind, timeout = getattr(request_context, "kind", None) or ("page", request_timeouts["page"])
+        if not timeout:
+            return original_get_page(pagerequest, *page_args, **page_kwargs)
+        for attempt in range(request_retries + 1):
+            try:
+                return call_with_deadline(original_get_page, timeout, pagerequest, *page_args, **page_kwargs)
+            except RequestTimeout as e:
+                logger.warning(f"{kind.capitalize()} request timed out ({e}), attempt {attempt + 1} of {request_retries + 1}: {pagerequest}")
+                reset_sessions()
+        raise RequestTimeout(f"{kind} request failed {request_retries + 1} times: {pagerequest}")
+    nav._get_page = get_page
+
+
+class Watchdog:
+    """Stops a run that exceeds --max-runtime or makes no progress for --stall-timeout seconds.
+
+    A first stall replaces the HTTP sessions (cancelling the stuck request so it is retried); if progress
+    still does not resume, or the runtime is exceeded, `stop_reason` is set so the run can checkpoint and
+    finish. A run that does not react within another stall period is checkpointed and exited from here.
+    """
+
+    def __init__(self, tracker, stall_timeout=None, max_runtime=None, checkpoint=None, exit_code=3, elapsed=0.0):
+        self.tracker = tracker
+        self.stall_timeout = stall_timeout
+        self.max_runtime = max_runtime
+        self.checkpoint = checkpoint
+        self.exit_code = exit_code
+        self.stop_reason = None
+        self.started = time.monotonic() - elapsed
+        self.reset_at = None
+        self.stopped_at = None
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self, reason):
+        self.stop_reason = reason
+        self.stopped_at = time.monotonic()
+        logger.error(f"Stopping the run: {reason}")
+
+    def run(self):
+        grace = self.stall_timeout or 60.0
+        while not self.done.wait(min(grace / 4, 1.0)):
+            now = time.monotonic()
+            idle = now - self.tracker.last_progress
+            if self.stop_reason is not None:
+                if self.exit_code is not None and now - self.stopped_at >= grace and idle >= grace:
+                    logger.error(f"The run did not stop within {grace:g} seconds; checkpointing and exiting.")
+                    if self.checkpoint is not None:
+                        self.checkpoint()
+                    stop_logging()
+                    os._exit(self.exit_code)
+            elif self.max_runtime and now - self.started >= self.max_runtime:
+                self.stop(f"maximum runtime of {self.max_runtime:g} seconds reached")
+            elif self.stall_timeout and idle >= self.stall_timeout:
+                if self.reset_at is None or self.reset_at < self.tracker.last_progress:
+                    logger.warning(f"No progress for {idle:.0f} seconds (stage {self.tracker.stage}); replacing HTTP sessions.")
+                    self.reset_at = now
+                    reset_sessions()
+                elif now - self.reset_at >= self.stall_timeout:
+                    self.stop(f"no progress for {idle:.0f} seconds (stage {self.tracker.stage})")
+
+    def close(self):
+        self.done.set()
+
+
 def getproxy(args):
+    global proxy_configured
+    if proxy_configured:
+        # Long-running processes (e.g. worker) set up the proxy once.
+        return
+    proxy_configured = True
+    if getattr(args, 'replay', None):
+        install_cassette(args)
+        return
+    try:
+        setup_proxy(args)
+    finally:
+        configure_http_sessions(args)
+    if getattr(args, 'record', None):
+        install_cassette(args)
+    install_request_deadlines(args)
+
+
+proxy_pool_file = os.path.expanduser("~/.config/scholarly-cli/proxies.json")
+PROXY_CHECK_URL = "http://httpbin.org/ip"
+
+
+def normalise_proxy(proxy):
+    return proxy if proxy.startswith("http") else "http://" + proxy
+
+
+def check_proxy(proxy, timeout=5.0):
+    """Return the latency of a request through `proxy` in seconds, or None if it does not work."""
+    start = time.monotonic()
+    try:
+        try:
+            client = httpx.Client(proxy=proxy, timeout=timeout)
+        except TypeError:  # httpx < 0.26
+            client = httpx.Client(proxies=proxy, timeout=timeout)
+        with client:
+            response = client.get(PROXY_CHECK_URL)
+        return time.monotonic() - start if response.status_code == 200 else None
+    except Exception:
+        return None
+
+
+class ProxyPool:
+    """Free proxies persisted between runs with their latency and last success, fastest first."""
+
+    def __init__(self, filename, max_failures=3, max_age_days=7):
+        self.filename = filename
+        self.max_failures = max_failures
+        self.max_age = max_age_days * 86400
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = set()
+        if os.path.exists(filename):
+            try:
+                self.entries = load_result_file(filename).get("proxies", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable proxy list {filename}: {e}")
+
+    def save(self):
+        with self.lock:
+            entries = dict(self.entries)
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        write_json_atomic({"updated": gettime(), "proxies": entries}, self.filename, indent=4)
+
+    def record(self, proxy, latency):
+        with self.lock:
+            entry = self.entries.setdefault(proxy, {"latency": None, "last_success": None, "failures": 0})
+            if latency is None:
+                entry["failures"] += 1
+                if entry["failures"] >= self.max_failures:
+                    del self.entries[proxy]
+            else:
+                entry.update(latency=round(latency, 3), last_success=time.time(), failures=0)
+
+    def validate(self, proxies, workers=16):
+        """Check proxies in parallel and record the results; returns the working ones, fastest first."""
+        proxies = list(proxies)
+        if not proxies:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(proxies))) as executor:
+            for proxy, latency in zip(proxies, executor.map(check_proxy, proxies)):
+                self.record(proxy, latency)
+        return self.ranked()
+
+    def revalidate(self):
+        now = time.time()
+        with self.lock:
+            stale = [p for p, e in self.entries.items() if now - (e.get("last_success") or 0) > self.max_age]
+            for proxy in stale:
+                del self.entries[proxy]
+            proxies = list(self.entries)
+        return self.validate(proxies)
+
+    def ranked(self):
+        with self.lock:
+            working = [p for p, e in self.entries.items() if e["failures"] == 0 and p not in self.dirty]
+            return sorted(working, key=lambda p: self.entries[p]["latency"] or float("inf"))
+
+    def discover(self, limit=50):
+        """Fetch a fresh list from free-proxy and validate a batch of it in parallel."""
+        try:
+            from fp.fp import FreeProxy
+            candidates = FreeProxy(rand=False).get_proxy_list(repeat=False)
+        except Exception as e:
+            logger.warning(f"Could not fetch new free proxies: {e}")
+            return []
+        candidates = [normalise_proxy(p) for p in candidates]
+        return self.validate([p for p in candidates if p not in self.entries][:limit])
+
+    def next_proxy(self, old_proxy):
+        """Proxy rotation for scholarly: drop the failing proxy and return the fastest remaining one."""
+        if old_proxy:
+            old_proxy = normalise_proxy(old_proxy)
+            self.record(old_proxy, None)
+            self.dirty.add(old_proxy)
+        ranked = self.ranked() or self.discover()
+        if not ranked:
+            raise Exception("None of the free proxies are working at the moment.")
+        self.save()
+        return ranked[0]
+
+    def refresh_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            working = self.revalidate()
+            if len(working) < 5:
+                self.discover()
+            self.save()
+            logger.debug(f"Proxy pool refreshed: {len(self.ranked())} working proxies")
+
+
+def current_proxy(pg):
+    return (getattr(pg, "_proxies", None) or {}).get("http://")
+
+
+def use_free_proxies(pg, args):
+    """Start from the persisted, revalidated free proxies; fall back to scholarly's slow discovery."""
+    pool = ProxyPool(proxy_pool_file)
+    working = pool.revalidate()
+    logger.info(f"{len(working)} of the saved free proxies are working")
+    # scholarly looks the failing proxy up under 'http', but keys its proxies 'http://', so the generator
+    # is always passed None on rotation; the proxy still in use is the one that failed.
+    for proxy in working[:5]:
+        if pg.SingleProxy(http=proxy):
+            pg._set_proxy_generator(lambda old_proxy: pool.next_proxy(old_proxy or current_proxy(pg)))
+            break
+        pool.record(proxy, None)
+    else:
+        pg.FreeProxies()
+        discovered_proxy_gen = pg._proxy_gen
+
+        def proxy_gen(old_proxy):
+            old_proxy = old_proxy or current_proxy(pg)
+            if old_proxy:
+                pool.record(normalise_proxy(old_proxy), None)
+            proxy = discovered_proxy_gen(old_proxy)
+            pool.record(normalise_proxy(proxy), check_proxy(normalise_proxy(proxy)))
+            pool.save()
+            return proxy
+        pg._set_proxy_generator(proxy_gen)
+        current = current_proxy(pg)
+        if current:
+            pool.record(current, check_proxy(current))
+    pool.save()
+    if getattr(args, 'proxy_refresh', 0) > 0:
+        threading.Thread(target=pool.refresh_forever, args=(args.proxy_refresh,), name="proxy-refresh", daemon=True).start()
+    # The same generator serves as the secondary proxy, so scholarly does not run its own discovery again.
+    scholarly.use_proxy(pg, pg)
+
+
+def setup_proxy(args):
     pg = ProxyGenerator()
     timestamp("api key from file")
     apikey = read_api_key()
@@ -151,20 +1099,413 @@ def getproxy(args):
         if not success:
             print("API key:", apikey)  # Debugging line
             timestamp("Failed connecting to ScraperAPI using provided API key.")
-            # timestamp("Falling back to free proxies.")
-            pg.FreeProxies()
-            scholarly.use_proxy(pg)  # Use free proxies
+            pg = ProxyGenerator()
+            use_free_proxies(pg, args)
             timestamp("Falling back to free proxies.")
+            return
         scholarly.use_proxy(pg)
         print("Using ScraperAPI with provided API key.")
     else:
         timestamp("API key not found or invalid. Using free proxies.")
-        pg.FreeProxies()
-        scholarly.use_proxy(pg)  # Use free proxies
+        use_free_proxies(pg, args)
+
+
+def prefetch_results(search_results, limit, depth, page_size=10, lock=None):
+    """Yield up to `limit` search results while a background thread fetches up to `depth` pages ahead.
+
+    Pages are still requested one after the other by a single thread, and no page beyond `limit` is
+    requested. scholarly's Navigator is not thread-safe, so a caller making requests of its own (e.g.
+    fills) passes a `lock` it holds for them; page fetches wait for it, keeping the request rate the
+    same as without prefetching.
+    """
+    buffer = queue.Queue(maxsize=max(depth, 1) * page_size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        results = itertools.islice(search_results, limit)
+        try:
+            while True:
+                with lock or contextlib.nullcontext():
+                    result = next(results, None)
+                if result is None:
+                    break
+                if not put(("result", result)):
+                    return
+        except Exception as e:
+            put(("error", e))
+            return
+        put(("done", None))
+
+    thread = threading.Thread(target=producer, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == "result":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                return
+    finally:
+        stop.set()
+
+
+# Short field names that map into the nested scholarly Publication dict.
+FIELD_PATHS = {
+    "title": ("bib", "title"),
+    "author": ("bib", "author"),
+    "year": ("bib", "pub_year"),
+    "venue": ("bib", "venue"),
+    "abstract": ("bib", "abstract"),
+    "citation": ("bib", "citation"),
+    "publisher": ("bib", "publisher"),
+}
+# Top-level Publication keys and (reached through get_field's "bib" fallback) BibEntry keys.
+PUBLICATION_FIELDS = ("bib", "gsrank", "author_id", "num_citations", "cites_id", "citedby_url", "cites_per_year",
+                      "author_pub_id", "public_access", "mandates", "eprint_url", "pub_url", "url_add_sclib",
+                      "url_related_articles", "url_scholarbib", "filled", "source", "container_type")
+BIB_FIELDS = ("pub_type", "bib_id", "abstract", "title", "author", "pub_year", "venue", "journal", "volume",
+              "number", "pages", "publisher", "citation")
+
+
+def normalise_title(title):
+    return re.sub(r'\W+', ' ', (title or "").lower()).strip()
+
+
+def title_hash(title):
+    return hashlib.sha1(normalise_title(title).encode('utf-8')).hexdigest()[:16]
+
+
+def publication_id(publication):
+    """Return a stable id for a publication: the Scholar cluster id if available, else a title hash."""
+    if publication.get("id"):
+        return publication["id"]
+    match = re.search(r'info:([\w-]+):', publication.get("url_scholarbib") or "")
+    if match:
+        return match.group(1)
+    match = re.search(r'cites=(\d+)', publication.get("citedby_url") or "")
+    if match:
+        return match.group(1)
+    if publication.get("pub_url"):
+        return publication["pub_url"]
+    return title_hash(get_field(publication, "title"))
+
+
+def get_field(publication, name):
+    """Return a field from either a full scholarly Publication or a projected (flat) record."""
+    if name == "id":
+        return publication_id(publication)
+    if name in publication:
+        return publication[name]
+    value = publication
+    for key in FIELD_PATHS.get(name, ("bib", name)):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def make_record_type(fields):
+    """Return a compact (tuple-based) record type for the given projection; `id` is always kept."""
+    names = ["id"] + [name for name in fields if name != "id"]
+    unknown = [name for name in names[1:] if name not in FIELD_PATHS and name not in PUBLICATION_FIELDS
+               and name not in BIB_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown field(s) {', '.join(unknown)}")
+    return collections.namedtuple("Record", names)
+
+
+def project_publication(publication, record_type):
+    return record_type._make(get_field(publication, name) for name in record_type._fields)
+
+
+def record_to_dict(record):
+    return record._asdict() if hasattr(record, "_asdict") else record
+
+
+SCHOLAR_PAGE_SIZE = 10
+SCHOLAR_MAX_RESULTS = 1000  # Scholar serves no result pages beyond the first thousand hits.
+
+
+SCHOLAR_HOST = "https://scholar.google.com"
+
+
+class PageNavigator:
+    """Stands in for scholarly's Navigator over one already-fetched page, so its parsers can be reused."""
+
+    def __init__(self, html):
+        self.html = html
+        self.publib = ""
+
+    def _get_soup(self, url):
+        from bs4 import BeautifulSoup
+        # As Navigator._get_soup; any later page (e.g. "next") is empty, so iteration ends with this page.
+        html, self.html = self.html.replace('\xa0', ' '), ""
+        soup = BeautifulSoup(html, 'html.parser')
+        try:
+            self.publib = soup.find('div', id='gs_res_glb').get('data-sva')
+        except Exception:
+            pass
+        return soup
+
+
+def parse_result_page(html, url):
+    """Publications on a result page, parsed exactly as scholarly's search iterator does."""
+    from scholarly.publication_parser import _SearchScholarIterator
+    return list(_SearchScholarIterator(PageNavigator(html), url))
+
+
+def async_http_client(args, concurrency):
+    """An httpx.AsyncClient with the headers, cookies and proxy of scholarly's primary session."""
+    nav = getattr(scholarly, "_Scholarly__nav", None)
+    session = getattr(nav, "_session1", None)
+    proxies = getattr(getattr(nav, "pm1", None), "_proxies", None) or {}
+    proxy = proxies.get("https://") or proxies.get("http://")
+
+    async def on_response(response):
+        http_stats.on_response(response)
+
+    options = {
+        "headers": dict(session.headers) if session is not None else None,
+        "cookies": session.cookies if session is not None else None,
+        "limits": httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency,
+                               keepalive_expiry=getattr(args, 'keepalive', 60.0)),
+        "timeout": httpx.Timeout(getattr(args, 'http_timeout', 30.0)),
+        "follow_redirects": True,
+        "event_hooks": {"response": [on_response]},
+    }
+    if not proxy:
+        return httpx.AsyncClient(**options)
+    try:
+        return httpx.AsyncClient(proxy=proxy, **options)
+    except TypeError:  # httpx < 0.26
+        return httpx.AsyncClient(proxies=proxy, **options)
+
+
+async def fetch_page_async(client, url, semaphore, args):
+    """Fetch a Scholar page; after --request-retries failures hand it to scholarly's synchronous fetch."""
+    nav = scholarly._Scholarly__nav
+    timeout = getattr(args, 'page_timeout', None) or None
+    async with semaphore:
+        if client is not None:
+            for attempt in range(getattr(args, 'request_retries', 2) + 1):
+                try:
+                    response = await asyncio.wait_for(client.get(SCHOLAR_HOST + url), timeout)
+                    if response.status_code == 200 and not nav._requests_has_captcha(response.text):
+                        return response.text
+                    problem = f"status {response.status_code}" if response.status_code != 200 else "captcha"
+                except (asyncio.TimeoutError, httpx.HTTPError) as e:
+                    problem = repr(e)
+                logger.warning(f"Async request failed ({problem}), attempt {attempt + 1}: {url}", extra={"sample": "async"})
+                await asyncio.sleep(2 ** attempt)
+        # scholarly's fetch rotates proxies, handles captchas and replays/records cassettes.
+        return await asyncio.to_thread(nav._get_page, SCHOLAR_HOST + url)
+
+
+async def wait_unless_stopped(tasks, watchdog=None):
+    """Wait for `tasks`, cancelling the ones still pending once the watchdog asks the run to stop."""
+    pending = set(tasks)
+    while pending:
+        if watchdog is not None and watchdog.stop_reason is not None:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            return
+        _, pending = await asyncio.wait(pending, timeout=1.0)
+
+
+async def async_search(args, first_url, first_results, limit, tracker, fill_conditions=None, watchdog=None):
+    """Fetch the result pages after `first_url` concurrently and return up to `limit` results in rank order.
+
+    Results meeting the fill conditions (None: no filling) are then filled concurrently; scholarly's fill
+    runs on worker threads under --fill-concurrency, each with a --fill-timeout deadline. Once the
+    `watchdog` asks the run to stop, outstanding pages and fills are cancelled and the results so far
+    are returned.
+    """
+    direct = not (getattr(args, 'replay', None) or getattr(args, 'record', None))
+    page_semaphore = asyncio.Semaphore(args.concurrency)
+    client = async_http_client(args, args.concurrency) if direct else None
+    try:
+        async def page(start):
+            html = await fetch_page_async(client, f"{first_url}&start={start}", page_semaphore, args)
+            publications = await asyncio.to_thread(parse_result_page, html, first_url)
+            tracker.set_stage("search")
+            return publications
+
+        starts = range(SCHOLAR_PAGE_SIZE, limit, SCHOLAR_PAGE_SIZE) if len(first_results) >= SCHOLAR_PAGE_SIZE else []
+        tasks = [asyncio.create_task(page(start)) for start in starts]
+        results = list(first_results)
+        try:
+            for start, task in zip(starts, tasks):
+                await wait_unless_stopped([task], watchdog)
+                if task.cancelled():
+                    logger.warning(f"Stopped fetching pages at result {start + 1}")
+                    break
+                try:
+                    publications = task.result()
+                except Exception as e:
+                    logger.error(f"Failed to fetch results {start + 1}-{start + SCHOLAR_PAGE_SIZE}, stopping there: {e}")
+                    break
+                results.extend(publications)
+                if len(publications) < SCHOLAR_PAGE_SIZE:
+                    break  # the last page; later pages are empty
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        if client is not None:
+            await client.aclose()
+    results = results[:limit]
+
+    if fill_conditions is not None and (watchdog is None or watchdog.stop_reason is None):
+        fill_semaphore = asyncio.Semaphore(args.fill_concurrency)
+
+        async def fill(i):
+            async with fill_semaphore:
+                tracker.set_stage("fill")
+                try:
+                    results[i] = await asyncio.wait_for(asyncio.to_thread(get_full_publication_details, results[i]),
+                                                        getattr(args, 'fill_timeout', None) or None)
+                except Exception as e:
+                    logger.error(f"Failed to fill item {i + 1}, keeping the search snippet: {e!r}", extra={"sample": "fill"})
+                    tracker.error()
+        await wait_unless_stopped([asyncio.create_task(fill(i)) for i, result in enumerate(results)
+                                   if needs_fill(result, fill_conditions, args.fill_min_citations)], watchdog)
+    return results
+
+
+def count_histogram(args, search_query, year_low, year_high):
+    """Count results per --bucket years from year_low to year_high concurrently; returns [(low, high, count)].
+
+    Counts go through results_count_cache and a shared --count-rate limiter; a failed bucket counts as None.
+    """
+    buckets = [(low, min(low + args.bucket - 1, year_high)) for low in range(year_low, year_high + 1, args.bucket)]
+    limiter = RateLimiter(args.count_rate)
+
+    def count_bucket(bucket):
+        low, high = bucket
+        key = (search_query, low, high, args.patents, args.citations)
+        if key not in results_count_cache:
+            limiter.wait()
+            with request_kind("count"):
+                search_results = scholarly.search_pubs(search_query, patents=args.patents, citations=args.citations,
+                                                       year_low=low, year_high=high)
+                results_count_cache[key] = get_results_count(search_results)
+        return results_count_cache[key]
+
+    counts = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.count_workers) as executor:
+        futures = [executor.submit(count_bucket, bucket) for bucket in buckets]
+        for (low, high), future in zip(buckets, futures):
+            try:
+                counts.append((low, high, future.result()))
+            except Exception as e:
+                logger.error(f"Failed to count results for {low}-{high}: {e}")
+                counts.append((low, high, None))
+    return counts
+
+
+def sample_strata(total, size, rng):
+    """Split the accessible ranking into `size` equal strata and draw one (low, high, offset) from each."""
+    accessible = min(total, SCHOLAR_MAX_RESULTS)
+    size = min(size, accessible)
+    bounds = [accessible * i // size for i in range(size + 1)] if size else []
+    return [(low, high, rng.randrange(low, high)) for low, high in zip(bounds, bounds[1:])]
+
+
+def sample_results(first_page, search_query, search_kwargs, strata):
+    """Yield the result at each stratum's offset, fetching only the pages those offsets fall on.
+
+    `first_page` is the iterator the count came from, so offsets on the first page cost nothing extra.
+    """
+    pages = collections.defaultdict(list)
+    for _, _, offset in strata:
+        pages[offset // SCHOLAR_PAGE_SIZE * SCHOLAR_PAGE_SIZE].append(offset)
+    for page_start in sorted(pages):
+        if page_start == 0:
+            iterator = first_page
+        else:
+            iterator = scholarly.search_pubs(search_query, start_index=page_start, **search_kwargs)
+        position = page_start
+        for offset in sorted(pages[page_start]):
+            result = next(itertools.islice(iterator, offset - position, None), None)
+            if result is None:
+                logger.warning(f"Result {offset + 1} is not available; the sample is smaller than planned")
+                break
+            position = offset + 1
+            result["sampleRank"] = offset + 1
+            yield result
 
 
 def get_full_publication_details(publication):
-    return scholarly.fill(publication)
+    with request_kind("fill"):
+        return scholarly.fill(publication)
+
+
+FILL_CONDITIONS = ("truncated", "missing", "cited")
+
+
+def parse_fill_conditions(fill_when):
+    conditions = [c.strip() for c in (fill_when or "").split(',') if c.strip()]
+    unknown = [c for c in conditions if c not in FILL_CONDITIONS]
+    if unknown:
+        raise ValueError(f"unknown condition(s) {', '.join(unknown)}; use {', '.join(FILL_CONDITIONS)}")
+    return conditions
+
+
+def needs_fill(publication, conditions, min_citations=10):
+    """Decide whether filling a search snippet is worth a request; no conditions means always."""
+    if publication.get("filled"):
+        return False
+    if not conditions:
+        return True
+    bib = publication.get("bib") or {}
+    if "truncated" in conditions:
+        abstract = (bib.get("abstract") or "").rstrip()
+        if not abstract or abstract.endswith(("…", "...")):
+            return True
+    if "missing" in conditions and any(bib.get(key) in (None, "", "NA") for key in ("pub_year", "venue")):
+        return True
+    if "cited" in conditions and (publication.get("num_citations") or 0) >= min_citations:
+        return True
+    return False
+
+
+def fill_results(results, conditions, min_citations=10, budget=None, tracker=None, stopped=None):
+    """Fill the results that need it in place, most cited first if a budget is given; returns the number filled.
+
+    A failed fill keeps the search snippet and does not count towards the budget. Filling ends early
+    once `stopped()` (if given) returns true.
+    """
+    candidates = [i for i, result in enumerate(results) if needs_fill(result, conditions, min_citations)]
+    if budget is not None:
+        candidates.sort(key=lambda i: results[i].get("num_citations") or 0, reverse=True)
+    filled = 0
+    for i in candidates:
+        if (budget is not None and filled >= budget) or (stopped is not None and stopped()):
+            break
+        try:
+            results[i] = get_full_publication_details(results[i])
+            filled += 1
+        except Exception as e:
+            logger.error(f"Failed to fill {get_field(results[i], 'title')!r}, keeping the search snippet: {e}",
+                         extra={"sample": "fill"})
+            if tracker is not None:
+                tracker.error()
+        if tracker is not None:
+            tracker.touch()
+    return filled
 
 
 api_key_file = os.path.expanduser("~/.config/scholarly-cli/api_key.txt")
@@ -231,31 +1572,207 @@ def create_metadata(search_query, args, total_results_retrieved, total_results_t
         "queryUrl": queryUrl,
         "start_time": start_time,
         "end_time": gettime(),
-        "args": vars(args)
+        "args": {key: value for key, value in vars(args).items() if key != "sample_plan"}
     }
+    if getattr(args, "sample_plan", None):
+        metadata["sample"] = args.sample_plan
     return metadata
 
 
 def save_to_json(data, filename):
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    write_results_stream(data["meta"], data["results"], filename)
+
+
+INDEX_MAGIC = b"SCLIDX1\n"
+INDEX_HEADER = struct.Struct("<QI")  # size of the indexed result file, number of entries
+INDEX_ENTRY = struct.Struct("<QQI")  # key hash, byte offset, byte length
+
+
+def index_filename(filename):
+    return filename + ".idx"
+
+
+def index_key(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def record_index_keys(record):
+    """The keys a record can be looked up by: its publication id and its title hash."""
+    keys = {publication_id(record)}
+    title = get_field(record, "title")
+    if title:
+        keys.add(title_hash(title))
+    return keys
+
+
+def write_index(entries, size, filename):
+    """Write the sorted (key hash, offset, length) entries of a result file of `size` bytes to its sidecar."""
+    entries.sort()
+    tmp_filename = f"{filename}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(INDEX_MAGIC + INDEX_HEADER.pack(size, len(entries)))
+        for entry in entries:
+            f.write(INDEX_ENTRY.pack(*entry))
+    os.replace(tmp_filename, filename)
+
+
+def write_results_stream(meta, records, filename):
+    """Write {"meta": ..., "results": [...]} record by record, formatted as json.dump(indent=4) would.
+
+    The file is replaced atomically, and a sidecar index (`filename`.idx) of each record's byte range
+    is built along the way so single records can be read back with lookup_record().
+    """
+    tmp_filename = f"{filename}.{uuid.uuid4().hex}.tmp"
+    entries = []
+    with open(tmp_filename, 'wb') as f:
+        meta_json = json.dumps(meta, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+        offset = f.write(('{\n    "meta": ' + meta_json + ',\n    "results": [').encode("utf-8"))
+        separator = "\n"
+        for record in records:
+            offset += f.write((separator + " " * 8).encode("utf-8"))
+            record_json = json.dumps(record, indent=4, ensure_ascii=False).replace("\n", "\n" + " " * 8).encode("utf-8")
+            entries.extend((index_key(key), offset, len(record_json)) for key in record_index_keys(record))
+            offset += f.write(record_json)
+            separator = ",\n"
+        offset += f.write(("\n    ]\n}" if separator == ",\n" else "]\n}").encode("utf-8"))
+    os.replace(tmp_filename, filename)
+    write_index(entries, offset, index_filename(filename))
+
+
+def scan_result_offsets(text):
+    """Yield (start, end, record) character ranges of the records in a result file's text."""
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'[\s,:]*')
+    pos = whitespace.match(text, text.index("{") + 1).end()
+    while text[pos] != "}":
+        key, pos = decoder.raw_decode(text, pos)
+        pos = whitespace.match(text, pos).end()
+        if key != "results":
+            _, pos = decoder.raw_decode(text, pos)
+        else:
+            pos = whitespace.match(text, pos + 1).end()  # skip "["
+            while text[pos] != "]":
+                record, end = decoder.raw_decode(text, pos)
+                yield pos, end, record
+                pos = whitespace.match(text, end).end()
+            pos += 1
+        pos = whitespace.match(text, pos).end()
+
+
+def build_index(filename):
+    """Index an existing result file (json, in any formatting) without rewriting it."""
+    with open(filename, "rb") as f:
+        data = f.read()
+    text = data.decode("utf-8")
+    ascii_only = len(text) == len(data)
+    entries = []
+    byte_pos = char_pos = 0
+    for start, end, record in scan_result_offsets(text):
+        if not ascii_only:  # convert character offsets into byte offsets
+            byte_pos += len(text[char_pos:start].encode("utf-8"))
+            char_pos = start
+        byte_start = start if ascii_only else byte_pos
+        length = end - start if ascii_only else len(text[start:end].encode("utf-8"))
+        entries.extend((index_key(key), byte_start, length) for key in record_index_keys(record))
+    write_index(entries, len(data), index_filename(filename))
+    return len(entries)
+
+
+def index_is_current(filename):
+    """True if `filename` has a sidecar index that was built for its current contents."""
+    try:
+        with open(index_filename(filename), "rb") as f:
+            header = f.read(len(INDEX_MAGIC) + INDEX_HEADER.size)
+    except FileNotFoundError:
+        return False
+    if not header.startswith(INDEX_MAGIC) or len(header) < len(INDEX_MAGIC) + INDEX_HEADER.size:
+        return False
+    size, _ = INDEX_HEADER.unpack_from(header, len(INDEX_MAGIC))
+    return size == os.path.getsize(filename)
+
+
+def lookup_record(key, filenames):
+    """Yield (filename, record) for records whose publication id (or title) is `key`, using sidecar indexes.
+
+    Only the index and the matching byte ranges of each result file are read (memory-mapped); files
+    without a current index are skipped (see build_index()).
+    """
+    wanted = {key, title_hash(key)}
+    hashes = sorted({index_key(k) for k in wanted})
+    for filename in filenames:
+        if not index_is_current(filename):
+            logger.debug(f"No current index for {filename}, skipping")
+            continue
+        with open(index_filename(filename), "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+            _, count = INDEX_HEADER.unpack_from(index, len(INDEX_MAGIC))
+            base = len(INDEX_MAGIC) + INDEX_HEADER.size
+            ranges = set()
+            for wanted_hash in hashes:
+                lo, hi = 0, count
+                while lo < hi:  # leftmost entry with this key hash
+                    mid = (lo + hi) // 2
+                    if INDEX_ENTRY.unpack_from(index, base + mid * INDEX_ENTRY.size)[0] < wanted_hash:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                while lo < count:
+                    entry_hash, offset, length = INDEX_ENTRY.unpack_from(index, base + lo * INDEX_ENTRY.size)
+                    if entry_hash != wanted_hash:
+                        break
+                    ranges.add((offset, length))
+                    lo += 1
+        if not ranges:
+            continue
+        with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset, length in sorted(ranges):
+                record = json.loads(data[offset:offset + length].decode("utf-8"))
+                if record_index_keys(record) & wanted:  # guard against hash collisions
+                    yield filename, record
+
+
+def run_get(args):
+    filenames = [filename for filename in expand_file_patterns(args.files or ["*.json"])
+                 if not filename.endswith(".idx")]
+    if args.build:
+        for filename in filenames:
+            if not index_is_current(filename):
+                try:
+                    logger.info(f"Indexed {build_index(filename)} keys in {filename}")
+                except (ValueError, IndexError, UnicodeDecodeError) as e:
+                    logger.warning(f"Could not index {filename}: {e}")
+    found = 0
+    for filename, record in lookup_record(args.key, filenames):
+        found += 1
+        if args.all or found == 1:
+            print(json.dumps({"file": filename, "record": record}, indent=4, ensure_ascii=False))
+        if not args.all:
+            break
+    if not found:
+        logger.error(f"No record found for {args.key!r}")
+        return 1
+    return 0
 
 
 def count_results(args, search_query, timeout=30):
     """ Function to count results with a timeout. """
     try:
-        if hasattr(args, 'year_low') and hasattr(args, 'year_high'):
-            search_results = scholarly.search_pubs(
-                search_query, patents=args.patents, citations=args.citations, year_low=args.year_low, year_high=args.year_high)
-        else:
-            search_results = scholarly.search_pubs(
-                search_query, patents=args.patents, citations=args.citations)
-        return get_results_count(search_results)
+        return call_with_deadline(count_search_results, timeout, args, search_query)
     except Exception as e:
         print(f"Error counting results: {e}")
         return None
 
 
+def count_search_results(args, search_query):
+    if hasattr(args, 'year_low') and hasattr(args, 'year_high'):
+        search_results = scholarly.search_pubs(
+            search_query, patents=args.patents, citations=args.citations, year_low=args.year_low, year_high=args.year_high)
+    else:
+        search_results = scholarly.search_pubs(
+            search_query, patents=args.patents, citations=args.citations)
+    return get_results_count(search_results)
+
+
 def get_results_count(search_results):
     result_count = search_results._get_total_results()
     return result_count
@@ -267,44 +1784,68 @@ def format_count(result_count):
     return formatted_count
 
 
-def main():
-    start_time = time.time()
-    args = parse_arguments()
+def parse_date_range(date):
+    """Parse year, year-, -year or year_low-year_high into (year_low, year_high); raises ValueError."""
+    if '-' in date:
+        if date.startswith('-'):
+            return None, int(date[1:])
+        if date.endswith('-'):
+            return int(date[:-1]), None
+        year_low, year_high = map(int, date.split('-'))
+        return year_low, year_high
+    year = int(date)
+    return year, year
 
-    if args.command == 'config':
-        api_key = ask_for_api_key()
-        logger.info(f"API key saved to {api_key_file}")
-        return
 
-    # process all other options here.
+results_count_cache = {}
 
-    if args.command != "search":
-        logger.error("Please valid argument.")
-        return
+
+def run_search(args, on_result=None, exit_on_hang=True):
+    """Run a search; `on_result` (if given) receives each result as a dict as soon as it is final.
+
+    With `exit_on_hang`, a run that stays stuck after the watchdog asked it to stop is checkpointed and
+    the process exits (status 3); long-lived callers pass False and only get the stop request.
+    """
+    start_time = time.time()
 
     if args.date:
         try:
-            if '-' in args.date:
-                if args.date.startswith('-'):
-                    year_high = int(args.date[1:])
-                    args.year_low = None
-                    args.year_high = year_high
-                elif args.date.endswith('-'):
-                    year_low = int(args.date[:-1])
-                    args.year_low = year_low
-                    args.year_high = None
-                else:
-                    year_low, year_high = map(int, args.date.split('-'))
-                    args.year_low = year_low
-                    args.year_high = year_high
-            else:
-                year = int(args.date)
-                args.year_low = year
-                args.year_high = year
+            args.year_low, args.year_high = parse_date_range(args.date)
         except ValueError:
             logger.error(
                 "Invalid date format. Please use year, year-, -year or year_low-year_high format.")
             return
+    if args.histogram and not args.count:
+        logger.error("--histogram only applies to --count.")
+        return
+    if args.bucket < 1:
+        logger.error("--bucket must be at least 1 year.")
+        return
+
+    record_type = None
+    if args.fields:
+        try:
+            record_type = make_record_type([f.strip() for f in args.fields.split(',') if f.strip()])
+        except ValueError as e:
+            logger.error(f"Invalid --fields: {e}")
+            return
+
+    try:
+        fill_conditions = parse_fill_conditions(args.fill_when)
+    except ValueError as e:
+        logger.error(f"Invalid --fill-when: {e}")
+        return
+    # With a budget, filling is deferred until a batch is written so the most cited results can go first.
+    deferred_fill = args.fill and args.fill_budget is not None
+    fill_budget = args.fill_budget
+    items_filled = 0
+
+    remaining_queries = 20000  # Example initial value, replace with actual value
+    profiler = PhaseProfiler() if args.profile else None
+    tracker = ProgressTracker(args.limit, quota=remaining_queries, profiler=profiler)
+    report_state = {}
+    if args.status_port is not None:
+        start_status_server(tracker, args.status_port)
 
     search_query = args.search
     search_query_str = " ".join(search_query)
@@ -314,6 +1855,7 @@ def main():
         start_time_fmt = start_time_datetime.strftime('%Y%m%d-%H%M%S')
         filenameBase = start_time_fmt + "-" + filenameBase
 
+    tracker.set_stage("expansion")
     # Check if search_query contains '...'
     if not(args.noexpansion) and ('...' in search_query or len(search_query) > 1 or re.match("AND", search_query_str)):
         print(f"Original search query: {search_query}")
@@ -354,65 +1896,179 @@ def main():
         test_url_length(search_query)
         return
 
+    tracker.set_stage("proxy")
+    report_progress(tracker, args, report_state, force=True)
     getproxy(args)
 
-    search_results = scholarly.search_pubs(expanded_search_query, patents=args.patents,
-                                           citations=args.citations, year_low=args.year_low if hasattr(args, 'year_low') else None, year_high=args.year_high if hasattr(args, 'year_high') else None)
-
-    remaining_queries = 20000  # Example initial value, replace with actual value
+    tracker.set_stage("count")
+    year_low = args.year_low if hasattr(args, 'year_low') else None
+    year_high = args.year_high if hasattr(args, 'year_high') else None
+    count_key = (expanded_search_query, year_low, year_high, args.patents, args.citations)
+    if args.count and count_key in results_count_cache:
+        # Long-running processes (serve) answer repeated counts from memory.
+        total_results_this_query = results_count_cache[count_key]
+    else:
+        with request_kind("count"):
+            search_results = scholarly.search_pubs(expanded_search_query, patents=args.patents,
+                                                   citations=args.citations, year_low=year_low, year_high=year_high)
+            total_results_this_query = get_results_count(search_results)
+        results_count_cache[count_key] = total_results_this_query
 
     total_number_of_items = args.limit
     total_results_retrieved = 0
 
-    total_results_this_query = get_results_count(search_results)
     with open(filenameBase + ".tsv", 'w') as f:
         # Write count, search_query, and expanded_search_query to the file, separated by tabs
         f.write(f"{total_results_this_query}\t{search_query}\t{expanded_search_query}\n")
     formatted_count = format_count(total_results_this_query)
     print(f"Total number of results: {formatted_count}")
+    profile_dir = (args.save if args.save else filenameBase) + ".profile"
+    if args.count and args.histogram:
+        if year_low is None:
+            logger.error("--histogram requires --date with a start year, e.g. 2000-2020 or 2000-.")
+            return
+        tracker.set_stage("histogram")
+        histogram = count_histogram(args, expanded_search_query, year_low,
+                                    year_high if year_high is not None else datetime.date.today().year)
+        with open(filenameBase + ".tsv", 'a') as f:
+            for low, high, count in histogram:
+                f.write(f"{'NA' if count is None else count}\t{search_query}\t{expanded_search_query}\t{low}\t{high}\n")
+        for low, high, count in histogram:
+            print(f"{low}-{high}\t{'NA' if count is None else format_count(count)}" if high > low else
+                  f"{low}\t{'NA' if count is None else format_count(count)}")
     if args.count:
-        return
+        tracker.set_stage("done")
+        report_progress(tracker, args, report_state, force=True)
+        if profiler is not None:
+            profiler.report(profile_dir)
+        return {"resultsAvailable": total_results_this_query, "retrieved": 0}
+
+    batch_in_progress = None
+    # Held for fills while --prefetch fetches pages in the background (see prefetch_results()).
+    navigator_lock = threading.Lock() if args.prefetch > 0 else contextlib.nullcontext()
+
+    def write_batch(batch, chunk_number):
+        nonlocal fill_budget, items_filled, batch_in_progress
+        batch_in_progress = (batch, chunk_number)
+        if deferred_fill:
+            tracker.set_stage("fill")
+            with navigator_lock:
+                filled = fill_results(batch, fill_conditions, args.fill_min_citations, fill_budget, tracker,
+                                      stopped=lambda: watchdog.stop_reason is not None)
+            fill_budget -= filled
+            items_filled += filled
+            if record_type is not None:
+                batch = [project_publication(r, record_type) for r in batch]
+            if on_result is not None:
+                for r in batch:
+                    on_result(record_to_dict(r))
+        tracker.set_stage("write")
+        write_data(args, search_query, start_time, total_results_retrieved, total_results_this_query,
+                   searchID, queryUrl, chunk_number, batch)
+        batch_in_progress = None
+        tracker.set_stage("search")
 
+    tracker.set_stage("search")
     items_retrieved = 0
     retrieved_results = []
     items_in_chunk = 0
     chunk_number = -1
 
-    for result in search_results:
-        items_retrieved += 1
-        items_in_chunk += 1
+    def checkpoint():
+        # Called by the watchdog while this thread is stuck in a request, so nothing else touches these.
+        if batch_in_progress is not None:
+            batch, number = batch_in_progress  # stuck filling or writing a batch: save it under its own number
+        else:
+            batch, number = retrieved_results, chunk_number + 1 if args.chunksize else -1
+        write_data(args, search_query, start_time, total_results_retrieved, total_results_this_query,
+                   searchID, queryUrl, number, batch)
 
-        if items_retrieved > total_number_of_items:
-            break
+    watchdog = Watchdog(tracker, stall_timeout=args.stall_timeout, max_runtime=args.max_runtime, checkpoint=checkpoint,
+                        exit_code=3 if exit_on_hang else None, elapsed=time.time() - start_time)
+    async_fetched = False
+    try:
+        if args.engine == "async" and not args.sample:
+            first_url = getattr(search_results, "_url", None)
+            first_results = list(itertools.islice(search_results, min(total_number_of_items, SCHOLAR_PAGE_SIZE)))
+            if first_url is None:
+                logger.warning("This scholarly version does not expose the search url; using the synchronous engine.")
+                search_results = itertools.chain(first_results, itertools.islice(search_results, total_number_of_items - len(first_results)))
+            else:
+                async_fill = fill_conditions if args.fill and not deferred_fill else None
+                limit = min(total_number_of_items, total_results_this_query or total_number_of_items, SCHOLAR_MAX_RESULTS)
+                results = asyncio.run(async_search(args, first_url, first_results, limit, tracker, async_fill, watchdog))
+                async_fetched = True
+                if async_fill is not None:
+                    items_filled += sum(1 for result in results if result.get("filled"))
+                search_results = iter(results)
+        elif args.sample:
+            seed = args.seed if args.seed is not None else random.randrange(2**32)
+            strata = sample_strata(total_results_this_query or 0, args.sample, random.Random(seed))
+            args.sample_plan = {"size": len(strata), "seed": seed, "resultsAvailable": total_results_this_query,
+                                "accessible": strata[-1][1] if strata else 0,
+                                "pages": len({offset // SCHOLAR_PAGE_SIZE for _, _, offset in strata}),
+                                "strata": [{"from": low, "to": high, "offset": offset} for low, high, offset in strata]}
+            logger.info(f"Sampling {len(strata)} of {total_results_this_query} results from {args.sample_plan['pages']} pages (seed {seed})")
+            tracker.total = len(strata)
+            search_results = sample_results(search_results, expanded_search_query,
+                                            dict(patents=args.patents, citations=args.citations,
+                                                 year_low=year_low, year_high=year_high), strata)
+        elif args.prefetch > 0:
+            search_results = prefetch_results(search_results, total_number_of_items, args.prefetch,
+                                              lock=navigator_lock)
+        else:
+            search_results = itertools.islice(search_results, total_number_of_items)
 
-        remaining_queries -= 1
+        for result in search_results:
+            items_retrieved += 1
+            items_in_chunk += 1
 
-        if args.fill:
-            result = get_full_publication_details(result)
+            remaining_queries -= 1
 
-        retrieved_results.append(result)
-        total_results_retrieved += 1  # Increment total results estimate
+            if args.fill and not deferred_fill and not async_fetched and needs_fill(result, fill_conditions, args.fill_min_citations):
+                tracker.set_stage("fill")
+                try:
+                    with navigator_lock:
+                        result = get_full_publication_details(result)
+                    items_filled += 1
+                except Exception as e:
+                    logger.error(f"Failed to fill item {items_retrieved}, keeping the search snippet: {e}", extra={"sample": "fill"})
+                    tracker.error()
+                tracker.set_stage("search")
 
-        if args.chunksize and items_in_chunk >= args.chunksize:
-            chunk_number += 1
-            write_data(args, search_query, start_time, total_results_retrieved, total_results_this_query,
-                       searchID, queryUrl, chunk_number, retrieved_results)
-            retrieved_results = []
-            items_in_chunk = 0
+            if record_type is not None and not deferred_fill:
+                result = project_publication(result, record_type)
+
+            if on_result is not None and not deferred_fill:
+                on_result(record_to_dict(result))
+
+            retrieved_results.append(result)
+            total_results_retrieved += 1  # Increment total results estimate
 
-        progress = round((items_retrieved / total_number_of_items) * 100)
-        log_additional_info(items_retrieved, progress, remaining_queries,
-                            total_results_retrieved, 10, start_time, remaining_queries)
+            if args.chunksize and items_in_chunk >= args.chunksize:
+                chunk_number += 1
+                write_batch(retrieved_results, chunk_number)
+                retrieved_results = []
+                items_in_chunk = 0
+
+            tracker.item_done(quota=remaining_queries)
+            report_progress(tracker, args, report_state)
+
+            if watchdog.stop_reason is not None and not async_fetched:
+                break
+    finally:
+        watchdog.close()
 
     if retrieved_results:
         if args.chunksize is not None:
             chunk_number += 1
-        write_data(args, search_query, start_time, total_results_retrieved, total_results_this_query,
-                   searchID, queryUrl, chunk_number, retrieved_results)
+        write_batch(retrieved_results, chunk_number)
+    tracker.set_stage("done")
+    report_progress(tracker, args, report_state, force=True)
 
-    if not (args.json or args.ijson or args.bibtex):
+    if not (args.json or args.ijson or args.bibtex or args.format):
         logger.error(
-            "No output will be produced! Use --json, --ijson or --bibtex to specify output format.")
+            "No output will be produced! Use --json, --ijson, --bibtex or --format to specify output format.")
         return
 
     settings = {
@@ -421,9 +2077,16 @@ def main():
         "sort_by": args.sort_by
     }
     settings["time_end"] = gettime()
+    if args.fill:
+        logger.info(f"Filled {items_filled} of {total_results_retrieved} results.")
     elapsed_time = time.time() - start_time
     logger.info(f"Script executed in {elapsed_time:.2f} seconds.")
+    logger.info(f"HTTP: {http_stats.summary()}")
     logger.info("Script execution completed.")
+    if profiler is not None:
+        profiler.report(profile_dir)
+    return {"resultsAvailable": total_results_this_query, "retrieved": total_results_retrieved,
+            "stopped": watchdog.stop_reason}
 
 
 
@@ -438,7 +2101,7 @@ def write_data(args, search_query, start_time, total_results_retrieved, total_re
     if args.json:
         output_data = {
             "meta": create_metadata(search_query, args, total_results_retrieved, total_results_this_query,  searchID, queryUrl, chunk_number, args.chunksize, start_time_fmt2),
-            "results": result
+            "results": [record_to_dict(r) for r in result]
         }
         if chunk_number > -1:
             output_filename = f"{filenamestub}_{chunk_number}.json"
@@ -449,11 +2112,17 @@ def write_data(args, search_query, start_time, total_results_retrieved, total_re
             save_to_json(output_data, output_filename)
             logger.info(f"Results saved to {output_filename}")
 
+    if args.format:
+        extension = EXPORT_FORMATS[args.format][0]
+        output_filename = f"{filenamestub}_{chunk_number}{extension}" if chunk_number > -1 else filenamestub + extension
+        write_export((record_to_dict(r) for r in result), args.format, output_filename)
+        logger.info(f"Results exported to {output_filename}")
+
     if args.ijson:
         for i, result in enumerate(result):
             output_data = {
                 "meta": create_metadata(search_query, args, total_results_retrieved, total_results_this_query,  searchID, queryUrl, chunk_number, args.chunksize, start_time_fmt2),
-                "results": [result]
+                "results": [record_to_dict(result)]
             }
             output_filename = f"{filenamestub}_{i+1}.json"
             save_to_json(output_data, output_filename)
@@ -461,5 +2130,1539 @@ def write_data(args, search_query, start_time, total_results_retrieved, total_re
 
 
 
+QUEUE_STATES = ("pending", "leased", "done", "failed")
+QUEUE_COMMANDS = ("search", "fill")
+
+
+def queue_path(queue_dir, state, job_id=None):
+    path = os.path.join(queue_dir, state)
+    return os.path.join(path, job_id + ".json") if job_id else path
+
+
+def init_queue(queue_dir):
+    for state in QUEUE_STATES + ("leases", "results"):
+        os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+
+def write_json_atomic(data, filename, indent=None):
+    """Write json to a temporary file next to `filename` and move it into place."""
+    tmp_filename = f"{filename}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+    os.replace(tmp_filename, filename)
+
+
+def shard_job(job_argv, shard_years):
+    """Split a search job with --date year_low-year_high into jobs covering `shard_years` years each."""
+    args = parse_arguments(job_argv)
+    year_low, year_high = parse_date_range(args.date) if args.date else (None, None)
+    if year_low is None or year_high is None:
+        raise ValueError("--shard-years requires --date year_low-year_high")
+    base_argv = []
+    skip = False
+    for arg in job_argv:
+        if skip:
+            skip = False
+        elif arg == '--date':
+            skip = True
+        elif not arg.startswith('--date='):
+            base_argv.append(arg)
+    return [base_argv + ['--date', f"{year}-{min(year + shard_years - 1, year_high)}"]
+            for year in range(year_low, year_high + 1, shard_years)]
+
+
+def batch_fill_job(job_argv, batch_size):
+    """Split a fill job into jobs of `batch_size` files; paths are made absolute since workers run elsewhere."""
+    files = parse_arguments(job_argv).files
+    options = [arg for arg in job_argv[1:] if arg not in files]
+    files = [os.path.abspath(f) for f in files]
+    batch_size = batch_size or len(files)
+    return [["fill"] + files[i:i + batch_size] + options for i in range(0, len(files), batch_size)]
+
+
+def queue_add(args):
+    job_argv = args.job[1:] if args.job and args.job[0] == '--' else args.job
+    if not job_argv or job_argv[0] not in QUEUE_COMMANDS:
+        logger.error(f"Jobs must start with one of: {', '.join(QUEUE_COMMANDS)}")
+        return
+    parse_arguments(job_argv)  # Validate the job before it reaches a worker.
+    try:
+        if job_argv[0] == "fill":
+            jobs = batch_fill_job(job_argv, args.batch_size)
+        elif args.shard_years:
+            jobs = shard_job(job_argv, args.shard_years)
+        else:
+            jobs = [job_argv]
+    except ValueError as e:
+        logger.error(str(e))
+        return
+    init_queue(args.queue_dir)
+    for argv in jobs:
+        job_id = datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + "-" + uuid.uuid4().hex[:8]
+        write_json_atomic({"id": job_id, "argv": argv, "attempts": 0, "created": gettime()},
+                          queue_path(args.queue_dir, "pending", job_id))
+        logger.info(f"Queued job {job_id}: {' '.join(argv)}")
+
+
+def queue_status(args):
+    for state in QUEUE_STATES:
+        path = queue_path(args.queue_dir, state)
+        count = len([f for f in os.listdir(path) if f.endswith('.json')]) if os.path.isdir(path) else 0
+        print(f"{state}\t{count}")
+
+
+def claim_job(queue_dir, worker_id):
+    """Claim the oldest pending job by atomically renaming it into leased/; returns the job or None."""
+    pending_dir = queue_path(queue_dir, "pending")
+    for filename in sorted(os.listdir(pending_dir)):
+        if not filename.endswith('.json'):
+            continue
+        job_id = filename[:-len('.json')]
+        leased_file = queue_path(queue_dir, "leased", job_id)
+        pending_file = os.path.join(pending_dir, filename)
+        try:
+            # rename() keeps the mtime, which reap_expired_leases() reads as the lease's last heartbeat;
+            # a job that waited longer than --lease would otherwise look expired the moment it is claimed.
+            now = time.time()
+            os.utime(pending_file, (now, now))
+            os.rename(pending_file, leased_file)
+        except FileNotFoundError:
+            continue  # Another worker was faster.
+        try:
+            with open(leased_file, 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            logger.warning(f"Lost job {job_id} while claiming it.")
+            continue
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["worker"] = worker_id
+        write_json_atomic(job, leased_file)
+        renew_lease(queue_dir, job_id, worker_id)
+        return job
+    return None
+
+
+def renew_lease(queue_dir, job_id, worker_id):
+    """Heartbeat: refresh the lease file and the mtime of the leased job file."""
+    now = time.time()
+    write_json_atomic({"job": job_id, "worker": worker_id, "heartbeat": now},
+                      os.path.join(queue_dir, "leases", job_id + ".lease"))
+    os.utime(queue_path(queue_dir, "leased", job_id), (now, now))
+
+
+def release_job(queue_dir, job_id, state):
+    """Move a leased job to `state`; returns False if the lease was lost to another worker."""
+    try:
+        os.rename(queue_path(queue_dir, "leased", job_id), queue_path(queue_dir, state, job_id))
+    except FileNotFoundError:
+        return False
+    finally:
+        try:
+            os.remove(os.path.join(queue_dir, "leases", job_id + ".lease"))
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def reap_expired_leases(queue_dir, lease_seconds):
+    """Return jobs whose worker stopped sending heartbeats to pending/."""
+    leased_dir = queue_path(queue_dir, "leased")
+    now = time.time()
+    for filename in os.listdir(leased_dir):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            age = now - os.path.getmtime(os.path.join(leased_dir, filename))
+        except FileNotFoundError:
+            continue
+        if age > lease_seconds and release_job(queue_dir, filename[:-len('.json')], "pending"):
+            logger.warning(f"Lease expired after {age:.0f}s, job {filename} returned to the queue.")
+
+
+def run_worker(args):
+    init_queue(args.queue_dir)
+    queue_dir = os.path.abspath(args.queue_dir)
+    worker_id = f"{os.uname().nodename}-{os.getpid()}"
+    logger.info(f"Worker {worker_id} polling {queue_dir}")
+    while True:
+        reap_expired_leases(queue_dir, args.lease)
+        job = claim_job(queue_dir, worker_id)
+        if job is None:
+            if args.exit_when_empty and not os.listdir(queue_path(queue_dir, "leased")):
+                logger.info("Queue is empty, worker exiting.")
+                return
+            time.sleep(args.poll)
+            continue
+        if job["attempts"] > args.max_attempts:
+            logger.error(f"Job {job['id']} failed {args.max_attempts} times, moving it to failed/.")
+            release_job(queue_dir, job["id"], "failed")
+            continue
+
+        stop_heartbeat = threading.Event()
+
+        def heartbeat(job_id=job["id"]):
+            while not stop_heartbeat.wait(args.heartbeat):
+                try:
+                    renew_lease(queue_dir, job_id, worker_id)
+                except FileNotFoundError:
+                    logger.warning(f"Lost the lease on job {job_id}.")
+                    return
+
+        heartbeat_thread = threading.Thread(target=heartbeat, name="heartbeat", daemon=True)
+        heartbeat_thread.start()
+        # Each job writes its outputs into its own directory.
+        job_dir = os.path.join(queue_dir, "results", job["id"])
+        os.makedirs(job_dir, exist_ok=True)
+        cwd = os.getcwd()
+        logger.info(f"Running job {job['id']} (attempt {job['attempts']}): {' '.join(job['argv'])}")
+        try:
+            os.chdir(job_dir)
+            job_args = parse_arguments(job["argv"])
+            if job_args.command == "fill" and not (job_args.inplace or job_args.outdir):
+                # Fill inputs are shared absolute paths; keep the outputs where queue merge finds them.
+                job_args.outdir = job_dir
+            outcome = run_command(job_args, exit_on_hang=False)
+            if isinstance(outcome, dict) and outcome.get("stopped"):
+                # The watchdog stopped a hung or overlong search; its partial output is retried.
+                logger.error(f"Job {job['id']} was stopped: {outcome['stopped']}")
+                state = "pending"
+            else:
+                state = "done"
+        except (Exception, SystemExit) as e:
+            logger.error(f"Job {job['id']} failed: {e}")
+            state = "pending"
+        finally:
+            os.chdir(cwd)
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+        if not release_job(queue_dir, job["id"], state):
+            logger.warning(f"Job {job['id']} was reassigned while running; its result may be duplicated.")
+
+
+def load_result_file(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing request starts at least 1/rate seconds apart."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(start - now)
+
+
+def fill_cache_path(cache_dir, publication):
+    key = hashlib.sha1(str(publication_id(publication)).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, key[:2], key + ".json")
+
+
+def fill_cached(publication, cache_dir, limiter):
+    """Fill a publication, reusing and updating the on-disk fill cache."""
+    cache_file = fill_cache_path(cache_dir, publication)
+    if os.path.exists(cache_file):
+        return load_result_file(cache_file), True
+    limiter.wait()
+    filled = get_full_publication_details(publication)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    write_json_atomic(filled, cache_file)
+    return filled, False
+
+
+def filled_filename(args, filename):
+    if args.inplace:
+        return filename
+    if args.outdir:
+        return os.path.join(args.outdir, os.path.basename(filename))
+    root, ext = os.path.splitext(filename)
+    return f"{root}.filled{ext}"
+
+
+def run_fill(args):
+    """Fill saved results in parallel; progress is checkpointed to the output file so reruns resume."""
+    try:
+        conditions = parse_fill_conditions(args.fill_when)
+    except ValueError as e:
+        logger.error(f"Invalid --fill-when: {e}")
+        return
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+    os.makedirs(args.cache, exist_ok=True)
+    getproxy(args)
+    limiter = RateLimiter(args.rate)
+    budget = args.fill_budget
+    totals = collections.Counter()
+
+    for filename in args.files:
+        output_filename = filled_filename(args, filename)
+        # Resume from an earlier partial output if there is one.
+        data = load_result_file(output_filename if os.path.exists(output_filename) else filename)
+        results = data.get("results", [])
+        candidates = []
+        for i, result in enumerate(results):
+            if not isinstance(result.get("bib"), dict):
+                totals["not fillable"] += 1
+            elif needs_fill(result, conditions, args.fill_min_citations):
+                candidates.append(i)
+        if budget is not None:
+            candidates.sort(key=lambda i: results[i].get("num_citations") or 0, reverse=True)
+        # Cache hits cost no request, so only fills from Scholar are charged to --fill-budget, and only
+        # once they succeed: a failed fill makes room for the next candidate.
+        cached = {i for i in candidates if os.path.exists(fill_cache_path(args.cache, results[i]))}
+        uncached = collections.deque(i for i in candidates if i not in cached)
+        fetching = set()
+        file_totals = collections.Counter()
+
+        since_checkpoint = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(fill_cached, results[i], args.cache, limiter): i for i in sorted(cached)}
+
+            def submit_uncached():
+                while uncached and (budget is None or len(fetching) < budget):
+                    i = uncached.popleft()
+                    fetching.add(i)
+                    futures[executor.submit(fill_cached, results[i], args.cache, limiter)] = i
+
+            submit_uncached()
+            while futures:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    i = futures.pop(future)
+                    fetching.discard(i)
+                    try:
+                        results[i], from_cache = future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to fill result {i + 1} in {filename}: {e}", extra={"sample": "fill"})
+                        file_totals["failed"] += 1
+                        continue
+                    file_totals["cached" if from_cache else "filled"] += 1
+                    if budget is not None and not from_cache:
+                        budget -= 1
+                    since_checkpoint += 1
+                    if since_checkpoint >= args.checkpoint:
+                        write_results_stream(data.get("meta", {}), results, output_filename)
+                        since_checkpoint = 0
+                submit_uncached()
+        totals.update(file_totals)
+
+        data.setdefault("meta", {})["filled"] = {"date": gettime(), "fillWhen": conditions}
+        write_results_stream(data["meta"], results, output_filename)
+        logger.info(f"Filled {file_totals['filled'] + file_totals['cached']} ({file_totals['cached']} from the cache) "
+                    f"of {len(results)} results from {filename} into {output_filename}")
+
+    logger.info(f"HTTP: {http_stats.summary()}")
+    logger.info("Fill summary: " + (", ".join(f"{k}: {v}" for k, v in sorted(totals.items())) or "nothing to fill"))
+    return dict(totals)
+
+
+def expand_file_patterns(patterns):
+    filenames = []
+    for pattern in patterns:
+        filenames.extend(sorted(glob.glob(pattern)) or [pattern])
+    return filenames
+
+
+def iter_result_file(filename):
+    """Yield (meta, results) for a json result file, or (None, [record]) per line of a jsonl file."""
+    if filename.endswith('.jsonl'):
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield None, [json.loads(line)]
+        return
+    data = load_result_file(filename)
+    yield data.get("meta"), data.get("results", [])
+
+
+def sort_key(field, reverse=False):
+    """Key for sorting records by year or citations; records without a value sort last either way."""
+    def key(record):
+        value = get_field(record, "num_citations" if field == "citations" else field)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return (1, 0)
+        return (0, -value if reverse else value)
+    return key
+
+
+def write_run(records, directory, key=None):
+    if key is not None:
+        records.sort(key=key)
+    fd, run_filename = tempfile.mkstemp(suffix='.jsonl', dir=directory)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return run_filename
+
+
+def read_run(run_filename):
+    with open(run_filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def merge_result_files(filenames, output_filename, sort_by=None, reverse=False, dedupe=True, run_size=50000):
+    """Stream result files into one output with bounded memory.
+
+    Input files are read one at a time and spilled to sorted runs of at most `run_size` records, which
+    are then k-way merged. Only the publication ids are kept in memory for deduplication.
+    """
+    key = sort_key(sort_by, reverse) if sort_by else None
+    seen = set()
+    sources = []
+    duplicates = 0
+    total = 0
+    output_dir = os.path.dirname(os.path.abspath(output_filename))
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+        runs = []
+        buffer = []
+        for filename in filenames:
+            for meta, results in iter_result_file(filename):
+                if meta is not None:
+                    sources.append({"file": filename, "meta": meta})
+                for result in results:
+                    if dedupe:
+                        pub_id = publication_id(result)
+                        if pub_id in seen:
+                            duplicates += 1
+                            continue
+                        seen.add(pub_id)
+                    buffer.append(result)
+                    total += 1
+                    if len(buffer) >= run_size:
+                        runs.append(write_run(buffer, tmp_dir, key))
+                        buffer = []
+        if buffer:
+            runs.append(write_run(buffer, tmp_dir, key))
+        seen.clear()
+        if key is not None:
+            records = heapq.merge(*(read_run(run) for run in runs), key=key)
+        else:
+            records = itertools.chain.from_iterable(read_run(run) for run in runs)
+        meta = {
+            "version": "OpenDevEd_jsonUploaderV01",
+            "source": "Google Scholar",
+            "date": gettime(),
+            "totalResultsRetrieved": total,
+            "duplicatesRemoved": duplicates,
+            "sortBy": sort_by,
+            "sortOrder": ("desc" if reverse else "asc") if sort_by else None,
+            "mergedFrom": sources,
+        }
+        write_results_stream(meta, records, output_filename)
+    logger.info(f"Merged {len(filenames)} files ({total} results, {duplicates} duplicates removed) into {output_filename}")
+
+
+def run_merge(args):
+    filenames = expand_file_patterns(args.files)
+    merge_result_files(filenames, args.output, sort_by=args.sort, reverse=args.order == "desc",
+                       dedupe=not args.keep_duplicates, run_size=args.run_size)
+
+
+http_client = None
+http_client_lock = threading.Lock()
+
+
+def get_http_client(args):
+    """Shared pooled client for the CLI's own (non-scholarly) requests, e.g. downloads."""
+    global http_client
+    with http_client_lock:
+        if http_client is None:
+            http_client = httpx.Client(follow_redirects=True,
+                                       headers={"User-Agent": "Mozilla/5.0 (compatible; scholarly-cli)"},
+                                       **http_session_options(args))
+        return http_client
+
+
+class HostLimiter:
+    """Per-host politeness: at most `per_host` parallel requests, starts spaced `delay` seconds apart."""
+
+    def __init__(self, per_host, delay):
+        self.per_host = per_host
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    @contextlib.contextmanager
+    def slot(self, url):
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = (threading.Semaphore(self.per_host), RateLimiter(1.0 / self.delay if self.delay else 0))
+            semaphore, limiter = self.hosts[host]
+        with semaphore:
+            limiter.wait()
+            yield
+
+
+DOWNLOAD_EXTENSIONS = {"application/pdf": ".pdf", "text/html": ".html", "application/xml": ".xml", "text/plain": ".txt"}
+
+
+def download_extension(url, content_type):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in DOWNLOAD_EXTENSIONS:
+        return DOWNLOAD_EXTENSIONS[content_type]
+    ext = os.path.splitext(urllib.parse.urlsplit(url).path)[1].lower()
+    return ext if re.fullmatch(r'\.\w{1,5}', ext) else ".bin"
+
+
+def download_file(client, url, store, limiter):
+    """Download `url` into the store, resuming a partial download; returns (sha256, path, size, content type)."""
+    partial_dir = os.path.join(store, "partial")
+    os.makedirs(partial_dir, exist_ok=True)
+    part_filename = os.path.join(partial_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + ".part")
+    offset = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with limiter.slot(url), client.stream("GET", url, headers=headers) as response:
+        if response.status_code == 416:
+            os.remove(part_filename)  # The partial file is stale; the retry starts over.
+            raise httpx.HTTPError(f"Range not satisfiable for {url}, restarting")
+        response.raise_for_status()
+        mode = 'ab' if offset and response.status_code == 206 else 'wb'
+        content_type = response.headers.get("content-type")
+        with open(part_filename, mode) as f:
+            for data in response.iter_bytes():
+                f.write(data)
+    digest = hashlib.sha256()
+    with open(part_filename, 'rb') as f:
+        for data in iter(lambda: f.read(1 << 20), b""):
+            digest.update(data)
+    sha256 = digest.hexdigest()
+    path = os.path.join("objects", sha256[:2], sha256 + download_extension(url, content_type))
+    full_path = os.path.join(store, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    size = os.path.getsize(part_filename)
+    if os.path.exists(full_path):
+        os.remove(part_filename)  # Same content was stored before.
+    else:
+        os.replace(part_filename, full_path)
+    return sha256, path, size, content_type
+
+
+def run_download(args):
+    """Download eprints with bounded concurrency into a content-addressed store; reruns skip finished ones."""
+    os.makedirs(args.store, exist_ok=True)
+    manifest_filename = os.path.join(args.store, "manifest.jsonl")
+    done = set()
+    if os.path.exists(manifest_filename):
+        with open(manifest_filename, 'r', encoding='utf-8') as f:
+            done = {json.loads(line)["id"] for line in f if line.strip()}
+
+    eprints = {}
+    for filename in expand_file_patterns(args.files):
+        for _, results in iter_result_file(filename):
+            for result in results:
+                url = get_field(result, "eprint_url")
+                pub_id = publication_id(result)
+                if url and pub_id not in done:
+                    eprints.setdefault(pub_id, url)
+    # Publications often share an eprint (e.g. Scholar versions); each url is downloaded once.
+    jobs = collections.defaultdict(list)
+    for pub_id, url in eprints.items():
+        jobs[url].append(pub_id)
+    logger.info(f"{len(eprints)} eprints ({len(jobs)} urls) to download, {len(done)} already in {manifest_filename}")
+
+    client = get_http_client(args)
+    limiter = HostLimiter(args.per_host, args.host_delay)
+    totals = collections.Counter()
+
+    def download(url):
+        for attempt in range(args.retries + 1):
+            try:
+                return download_file(client, url, args.store, limiter)
+            except (httpx.HTTPError, OSError) as e:
+                status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+                if attempt == args.retries or (status is not None and status < 500 and status != 429):
+                    raise
+                logger.warning(f"Download of {url} failed ({e}), retrying")
+                time.sleep(2 ** attempt)
+
+    with open(manifest_filename, 'a', encoding='utf-8') as manifest, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(download, url): url for url in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            url = futures[future]
+            try:
+                sha256, path, size, content_type = future.result()
+            except Exception as e:
+                logger.error(f"Failed to download {url}: {e}", extra={"sample": "download"})
+                totals["failed"] += len(jobs[url])
+                continue
+            for pub_id in jobs[url]:
+                manifest.write(json.dumps({"id": pub_id, "url": url, "sha256": sha256, "path": path, "size": size,
+                                           "content_type": content_type, "date": gettime()}) + "\n")
+            manifest.flush()
+            totals["downloaded"] += len(jobs[url])
+    logger.info(f"HTTP: {http_stats.summary()}")
+    logger.info("Download summary: " + (", ".join(f"{k}: {v}" for k, v in sorted(totals.items())) or "nothing to download"))
+
+
+def first_author(publication):
+    authors = get_field(publication, "author")
+    if isinstance(authors, str):
+        authors = re.split(r'\s+and\s+|,', authors)
+    if not authors:
+        return ""
+    names = normalise_title(authors[0]).split()
+    return names[-1] if names else ""
+
+
+def dedupe_text(publication):
+    """Normalized title + first author surname + year, the text near-duplicates are compared on."""
+    return " ".join(filter(None, [normalise_title(get_field(publication, "title")), first_author(publication),
+                                  str(get_field(publication, "year") or "")]))
+
+
+def canonical_rank(publication):
+    """Higher is better: filled records, then records with an abstract, then the most cited."""
+    return (bool(publication.get("filled")), bool(get_field(publication, "abstract")),
+            int(get_field(publication, "num_citations") or 0), bool(get_field(publication, "eprint_url")))
+
+
+def minhash_signatures(np, texts, num_perm, seed=1, max_batch_bytes=50000):
+    """MinHash signatures (n x num_perm, uint32) over the 4-byte shingles of each text.
+
+    Shingles are read straight from the utf-8 bytes as uint32 values and permuted with multiply-shift
+    hashing, all in vectorized batches of about `max_batch_bytes` bytes of text.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+    encoded = [f" {text} ".encode('utf-8').ljust(4) for text in texts]
+    signatures = np.empty((len(encoded), num_perm), dtype=np.uint32)
+    start = 0
+    while start < len(encoded):
+        end, size = start, 0
+        while end < len(encoded) and (size == 0 or size + len(encoded[end]) <= max_batch_bytes):
+            size += len(encoded[end])
+            end += 1
+        batch = encoded[start:end]
+        data = np.frombuffer(b"".join(batch), dtype=np.uint8).astype(np.uint64)
+        windows = (data[:-3] << np.uint64(24)) | (data[1:-2] << np.uint64(16)) | (data[2:-1] << np.uint64(8)) | data[3:]
+        lengths = np.array([len(text) for text in batch])
+        counts = lengths - 3
+        text_offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+        window_offsets = np.r_[0, np.cumsum(counts)[:-1]]
+        # Keep only the windows that lie within a single text.
+        shingles = windows[np.arange(counts.sum()) + np.repeat(text_offsets - window_offsets, counts)]
+        with np.errstate(over='ignore'):
+            permuted = ((a[:, None] * shingles[None, :] + b[:, None]) >> np.uint64(32)).astype(np.uint32)
+        signatures[start:end] = np.minimum.reduceat(permuted, window_offsets, axis=1).T
+        start = end
+    return signatures
+
+
+def lsh_clusters(np, signatures, bands, threshold):
+    """Group records whose signatures collide in any LSH band and agree on at least `threshold` of positions."""
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        band_values = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        keys = band_values.view(np.dtype((np.void, band_values.dtype.itemsize * rows))).ravel()
+        _, buckets = np.unique(keys, return_inverse=True)
+        order = np.argsort(buckets, kind='stable')
+        sorted_buckets = buckets[order]
+        starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            members = order[start:start + size]
+            similarity = (signatures[members[1:]] == signatures[members[0]]).mean(axis=1)
+            root = find(members[0])
+            for member in members[1:][similarity >= threshold]:
+                parent[find(member)] = root
+
+    clusters = collections.defaultdict(list)
+    for i in range(n):
+        clusters[find(i)].append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def run_dedupe(args):
+    try:
+        import numpy as np
+    except ImportError:
+        logger.error("dedupe requires numpy (pip install numpy).")
+        return
+    if args.num_perm % args.bands:
+        logger.error("--bands must divide --num-perm.")
+        return
+    filenames = expand_file_patterns(args.files)
+    ids, titles, ranks, texts = [], [], [], []
+    for filename in filenames:
+        for _, results in iter_result_file(filename):
+            for result in results:
+                text = dedupe_text(result)
+                if not text:
+                    continue
+                ids.append(publication_id(result))
+                titles.append(get_field(result, "title"))
+                ranks.append(canonical_rank(result))
+                texts.append(text)
+    logger.info(f"Computing MinHash signatures for {len(ids)} records")
+    signatures = minhash_signatures(np, texts, args.num_perm)
+    del texts
+    clusters = lsh_clusters(np, signatures, args.bands, args.threshold)
+
+    output_clusters = []
+    duplicates = set()
+    for members in sorted(clusters, key=len, reverse=True):
+        canonical = max(members, key=lambda i: ranks[i])
+        member_ids = list(dict.fromkeys(ids[i] for i in members))
+        if len(member_ids) < 2:
+            continue  # The same publication listed more than once, not a near-duplicate.
+        output_clusters.append({
+            "canonical": ids[canonical],
+            "members": member_ids,
+            "titles": [titles[i] for i in members],
+        })
+        duplicates.update(pub_id for pub_id in member_ids if pub_id != ids[canonical])
+    write_json_atomic({
+        "meta": {"date": gettime(), "files": filenames, "records": len(ids), "threshold": args.threshold,
+                 "numPerm": args.num_perm, "bands": args.bands, "clusters": len(output_clusters),
+                 "duplicates": len(duplicates)},
+        "clusters": output_clusters,
+    }, args.output, indent=4)
+    logger.info(f"Found {len(output_clusters)} duplicate clusters ({len(duplicates)} duplicates) in {len(ids)} records; written to {args.output}")
+
+    if args.deduped:
+        def canonical_records():
+            seen = set()
+            for filename in filenames:
+                for _, results in iter_result_file(filename):
+                    for result in results:
+                        pub_id = publication_id(result)
+                        if pub_id not in duplicates and pub_id not in seen:
+                            seen.add(pub_id)
+                            yield result
+        write_results_stream({"version": "OpenDevEd_jsonUploaderV01", "source": "Google Scholar", "date": gettime(),
+                              "dedupedFrom": filenames, "duplicatesRemoved": len(duplicates)},
+                             canonical_records(), args.deduped)
+        logger.info(f"Deduplicated results written to {args.deduped}")
+
+
+def load_columns(np, filenames):
+    """Load result files once into columnar arrays: ids, queries, years, citations and venues (as codes)."""
+    ids, queries, years, citations, venues = [], [], [], [], []
+    query_codes, venue_codes = {}, {}
+    for filename in filenames:
+        for meta, results in iter_result_file(filename):
+            query = meta.get("query") if meta else None
+            query = " ".join(query) if isinstance(query, list) else (query or filename)
+            query_code = query_codes.setdefault(query, len(query_codes))
+            for result in results:
+                ids.append(publication_id(result))
+                queries.append(query_code)
+                try:
+                    years.append(int(get_field(result, "year")))
+                except (TypeError, ValueError):
+                    years.append(-1)
+                citations.append(int(get_field(result, "num_citations") or 0))
+                venue = (get_field(result, "venue") or "").strip()
+                venues.append(venue_codes.setdefault(venue, len(venue_codes)) if venue and venue != "NA" else -1)
+    _, id_codes = np.unique(np.array(ids, dtype=object).astype(str), return_inverse=True)
+    return {
+        "id": id_codes.ravel(),
+        "query": np.array(queries, dtype=np.int32),
+        "year": np.array(years, dtype=np.int32),
+        "citations": np.array(citations, dtype=np.int64),
+        "venue": np.array(venues, dtype=np.int32),
+        "query_names": list(query_codes),
+        "venue_names": list(venue_codes),
+    }
+
+
+def write_csv(filename, header, rows):
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+CITATION_BINS = [0, 1, 2, 6, 11, 51, 101, 501, 1001]
+
+
+def run_analyze(args):
+    try:
+        import numpy as np
+        import scipy.sparse
+    except ImportError:
+        logger.error("analyze requires numpy and scipy (pip install numpy scipy).")
+        return
+    filenames = expand_file_patterns(args.files)
+    columns = load_columns(np, filenames)
+    os.makedirs(args.outdir, exist_ok=True)
+    n = len(columns["id"])
+    if n == 0:
+        logger.error("No results found.")
+        return
+    # Unique publications: the first occurrence of each id.
+    _, first = np.unique(columns["id"], return_index=True)
+    year, citations, venue = columns["year"][first], columns["citations"][first], columns["venue"][first]
+
+    years, year_counts = np.unique(year[year >= 0], return_counts=True)
+    write_csv(os.path.join(args.outdir, "years.csv"), ["year", "count"], zip(years.tolist(), year_counts.tolist()))
+
+    known = venue >= 0
+    venue_counts = np.bincount(venue[known], minlength=len(columns["venue_names"]))
+    venue_citations = np.bincount(venue[known], weights=citations[known], minlength=len(columns["venue_names"]))
+    top = np.argsort(-venue_counts, kind='stable')[:args.top]
+    write_csv(os.path.join(args.outdir, "venues.csv"), ["venue", "count", "citations"],
+              ([columns["venue_names"][i], int(venue_counts[i]), int(venue_citations[i])] for i in top if venue_counts[i]))
+
+    bins = CITATION_BINS + [max(int(citations.max()) + 1, CITATION_BINS[-1] + 1)]
+    histogram, _ = np.histogram(citations, bins=bins)
+    labels = [f"{low}-{high - 1}" if high - 1 > low else str(low) for low, high in zip(bins[:-1], bins[1:])]
+    labels[-1] = f"{CITATION_BINS[-1]}+"
+    write_csv(os.path.join(args.outdir, "citations.csv"), ["citations", "count"], zip(labels, histogram.tolist()))
+
+    # Sparse publications x queries incidence (one entry per unique pair); its Gram matrix holds the overlaps.
+    pairs = np.unique(np.stack([columns["id"], columns["query"]]), axis=1)
+    incidence = scipy.sparse.csr_matrix((np.ones(pairs.shape[1], dtype=np.int64), (pairs[0], pairs[1])),
+                                        shape=(int(columns["id"].max()) + 1, len(columns["query_names"])))
+    overlap = (incidence.T @ incidence).toarray()
+    names = columns["query_names"]
+    write_csv(os.path.join(args.outdir, "overlap.csv"), ["query_a", "query_b", "shared"],
+              ([names[i], names[j], int(overlap[i, j])] for i in range(len(names)) for j in range(i, len(names))))
+
+    percentiles = [0, 25, 50, 75, 90, 99, 100]
+    report = {
+        "date": gettime(),
+        "files": len(filenames),
+        "records": n,
+        "uniquePublications": len(first),
+        "queries": {name: int(overlap[i, i]) for i, name in enumerate(names)},
+        "yearRange": [int(years.min()), int(years.max())] if len(years) else None,
+        "missingYear": int((year < 0).sum()),
+        "venues": len(columns["venue_names"]),
+        "missingVenue": int((~known).sum()),
+        "citations": {
+            "total": int(citations.sum()),
+            "mean": round(float(citations.mean()), 2),
+            "percentiles": dict(zip(map(str, percentiles), np.percentile(citations, percentiles).tolist())),
+            "uncited": int((citations == 0).sum()),
+        },
+    }
+    write_json_atomic(report, os.path.join(args.outdir, "report.json"), indent=4)
+    logger.info(f"Analysed {n} records ({len(first)} unique) from {len(filenames)} files; report in {args.outdir}")
+
+
+SERVE_COMMANDS = ("search", "fill")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def run_serve(args):
+    """Serve jobs over HTTP: POST /jobs {"argv": ["search", "query", "--limit", "10"]} streams json lines back."""
+    getproxy(args)  # Set up the proxy and sessions once; every job reuses them.
+    job_slots = threading.Semaphore(args.max_jobs)
+    server_stats = collections.Counter()
+    started = gettime()
+
+    class JobHandler(http.server.BaseHTTPRequestHandler):
+        def send_json_line(self, data):
+            self.wfile.write((json.dumps(data, ensure_ascii=False) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path != "/status":
+                self.send_error(404)
+                return
+            body = json.dumps({"started": started, "jobs": dict(server_stats), "http": http_stats.summary(),
+                               "countCache": len(results_count_cache)}).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != "/jobs":
+                self.send_error(404)
+                return
+            try:
+                job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                job_argv = [str(arg) for arg in job["argv"]]
+                if not job_argv or job_argv[0] not in SERVE_COMMANDS:
+                    raise ValueError(f"argv must start with one of: {', '.join(SERVE_COMMANDS)}")
+                job_args = parse_arguments(job_argv)
+            except SystemExit:
+                self.send_error(400, "Invalid job arguments")
+                return
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_error(400, str(e))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            with job_slots:
+                server_stats["started"] += 1
+                logger.info(f"Job started: {' '.join(job_argv)}")
+                try:
+                    if job_args.command == "search":
+                        summary = run_search(job_args, on_result=lambda r: self.send_json_line({"type": "result", "result": r}),
+                                             exit_on_hang=False)
+                    else:
+                        summary = run_fill(job_args)
+                    self.send_json_line({"type": "done", "summary": summary})
+                    server_stats["done"] += 1
+                except (BrokenPipeError, ConnectionResetError):
+                    logger.warning("Client disconnected, job abandoned.")
+                    server_stats["abandoned"] += 1
+                except Exception as e:
+                    logger.error(f"Job failed: {e}")
+                    server_stats["failed"] += 1
+                    self.send_json_line({"type": "error", "message": str(e)})
+
+        def log_message(self, format, *log_args):
+            logger.debug(format % log_args)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, JobHandler)
+        address = f"unix:{args.socket}"
+    else:
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", args.port), JobHandler)
+        address = f"http://127.0.0.1:{server.server_address[1]}"
+    logger.info(f"Serving jobs on {address} (POST /jobs, GET /status)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Server stopped.")
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+def parse_time(value):
+    """Parse a gettime() timestamp (or an ISO date) into epoch seconds; None if missing or invalid."""
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_citation_count(publication):
+    """Current citation count: the total of the 'cited by' listing, or a title search for uncited records."""
+    citedby_url = get_field(publication, "citedby_url")
+    if citedby_url:
+        # None when the listing shows no total; an unknown count must not overwrite a real one.
+        return get_results_count(scholarly.search_pubs_custom_url(citedby_url))
+    title = get_field(publication, "title")
+    if not title:
+        return None
+    match = scholarly.search_single_pub(title)
+    if normalise_title(get_field(match, "title")) != normalise_title(title):
+        return None
+    return match.get("num_citations") or 0
+
+
+def run_refresh(args):
+    """Re-fetch citation counts for the stalest (then most cited) records within a request budget."""
+    filenames = expand_file_patterns(args.files)
+    unsupported = [filename for filename in filenames if not filename.endswith('.json')]
+    if unsupported:
+        logger.error(f"refresh rewrites .json result files in place; not supported: {', '.join(unsupported)}")
+        return
+    now = time.time()
+    candidates = []
+    for file_index, filename in enumerate(filenames):
+        for meta, results in iter_result_file(filename):
+            harvested = parse_time((meta or {}).get("date")) or 0
+            for record_index, result in enumerate(results):
+                updated = parse_time(result.get("citations_updated")) or harvested
+                if now - updated >= args.min_age * 86400:
+                    candidates.append((updated, -int(get_field(result, "num_citations") or 0), file_index, record_index))
+    candidates.sort()
+    selected = collections.defaultdict(list)
+    for _, _, file_index, record_index in candidates[:max(args.budget, 0)]:
+        selected[file_index].append(record_index)
+    logger.info(f"{len(candidates)} records are due for a refresh; refreshing {sum(map(len, selected.values()))}")
+
+    getproxy(args)
+    limiter = RateLimiter(args.rate)
+    totals = collections.Counter()
+
+    def refresh(publication):
+        limiter.wait()
+        return fetch_citation_count(publication)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for file_index in sorted(selected):
+            filename = filenames[file_index]
+            data = load_result_file(filename)
+            results = data["results"]
+            futures = {executor.submit(refresh, results[i]): i for i in selected[file_index]}
+            for future in concurrent.futures.as_completed(futures):
+                result = results[futures[future]]
+                try:
+                    count = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to refresh {get_field(result, 'title')!r}: {e}", extra={"sample": "refresh"})
+                    totals["failed"] += 1
+                    continue
+                if count is None:
+                    totals["not found"] += 1
+                    continue
+                totals["changed" if count != result.get("num_citations") else "unchanged"] += 1
+                result["num_citations"] = count
+                result["citations_updated"] = gettime()
+            write_results_stream(data.get("meta", {}), results, filename)
+            logger.info(f"Updated citation counts in {filename}")
+    logger.info("Refresh summary: " + (", ".join(f"{k}: {v}" for k, v in sorted(totals.items())) or "nothing to refresh"))
+    return dict(totals)
+
+
+CSL_TYPES = {"article": "article-journal", "inproceedings": "paper-conference", "conference": "paper-conference",
+             "incollection": "chapter", "book": "book", "phdthesis": "thesis", "mastersthesis": "thesis",
+             "techreport": "report"}
+RIS_TYPES = {"article": "JOUR", "inproceedings": "CPAPER", "conference": "CPAPER", "incollection": "CHAP",
+             "book": "BOOK", "phdthesis": "THES", "mastersthesis": "THES", "techreport": "RPRT"}
+CSV_COLUMNS = ["id", "title", "authors", "year", "venue", "publisher", "num_citations", "url", "eprint_url", "abstract"]
+
+
+def author_list(publication):
+    """Author names as a list; filled records carry a bibtex-style "A and B" string, snippets a list."""
+    authors = get_field(publication, "author") or []
+    if isinstance(authors, str):
+        authors = re.split(r'\s+and\s+', authors)
+    return [author.strip() for author in authors if known(author and author.strip())]
+
+
+def known(value):
+    """scholarly fills unknown fields with "NA"; exports leave them out instead."""
+    return None if value == "NA" else value
+
+
+def split_name(name):
+    """("family", "given") from "Family, Given" or "Given Family"."""
+    if "," in name:
+        family, given = name.split(",", 1)
+    else:
+        given, _, family = name.rpartition(" ")
+    return family.strip(), given.strip()
+
+
+def publication_to_csl(publication):
+    bib = publication.get("bib") if isinstance(publication.get("bib"), dict) else {}
+    item = {
+        "id": publication_id(publication),
+        "type": CSL_TYPES.get(bib.get("pub_type") or publication.get("pub_type"), "article"),
+        "title": get_field(publication, "title"),
+        "author": [dict(zip(("family", "given"), split_name(name))) for name in author_list(publication)],
+        "container-title": bib.get("journal") or bib.get("booktitle") or get_field(publication, "venue"),
+        "publisher": get_field(publication, "publisher"),
+        "volume": bib.get("volume"),
+        "issue": bib.get("number"),
+        "page": (bib.get("pages") or "").replace("--", "-"),
+        "abstract": get_field(publication, "abstract"),
+        "URL": publication.get("pub_url"),
+    }
+    year = str(get_field(publication, "year") or "")
+    if year.isdigit():
+        item["issued"] = {"date-parts": [[int(year)]]}
+    return {key: value for key, value in item.items() if known(value)}
+
+
+def publication_to_ris(publication):
+    bib = publication.get("bib") if isinstance(publication.get("bib"), dict) else {}
+    tags = [("TY", RIS_TYPES.get(bib.get("pub_type") or publication.get("pub_type"), "JOUR")),
+            ("ID", publication_id(publication)),
+            ("TI", get_field(publication, "title"))]
+    tags += [("AU", name) for name in author_list(publication)]
+    pages = (bib.get("pages") or "").replace("--", "-").split("-", 1)
+    tags += [("PY", get_field(publication, "year")),
+             ("T2", bib.get("journal") or bib.get("booktitle") or get_field(publication, "venue")),
+             ("PB", get_field(publication, "publisher")),
+             ("VL", bib.get("volume")),
+             ("IS", bib.get("number")),
+             ("SP", pages[0]),
+             ("EP", pages[1] if len(pages) > 1 else None),
+             ("AB", get_field(publication, "abstract")),
+             ("UR", publication.get("pub_url")),
+             ("L1", publication.get("eprint_url"))]
+    lines = [f"{tag}  - {' '.join(str(value).split())}" for tag, value in tags if known(value)]
+    return "\n".join(lines) + "\nER  - \n"
+
+
+def csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def publication_to_csv(publication):
+    return csv_line([known(value) for value in (
+        publication_id(publication), get_field(publication, "title"), "; ".join(author_list(publication)),
+        get_field(publication, "year"), get_field(publication, "venue"), get_field(publication, "publisher"),
+        publication.get("num_citations"), publication.get("pub_url"), publication.get("eprint_url"),
+        get_field(publication, "abstract"))])
+
+
+# format: (extension, converter, header, separator, footer)
+EXPORT_FORMATS = {
+    "csl": (".csl.json", lambda p: json.dumps(publication_to_csl(p), ensure_ascii=False), "[\n", ",\n", "\n]\n"),
+    "ris": (".ris", publication_to_ris, "", "\n", ""),
+    "csv": (".csv", publication_to_csv, csv_line(CSV_COLUMNS), "", ""),
+}
+
+
+def write_export_body(records, fmt, f):
+    """Write converted records (without header/footer) to an open text file; returns the number written."""
+    _, convert, _, separator, _ = EXPORT_FORMATS[fmt]
+    count = 0
+    for record in records:
+        f.write((separator if count else "") + convert(record))
+        count += 1
+    return count
+
+
+def write_export(records, fmt, filename):
+    _, _, header, _, footer = EXPORT_FORMATS[fmt]
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        f.write(header)
+        count = write_export_body(records, fmt, f)
+        f.write(footer)
+    return count
+
+
+def export_file_part(filename, fmt, part_filename):
+    """Convert one result file into a headerless part file (runs in a worker process)."""
+    def records():
+        for _, results in iter_result_file(filename):
+            yield from results
+    with open(part_filename, 'w', encoding='utf-8', newline='') as f:
+        return write_export_body(records(), fmt, f)
+
+
+def run_export(args):
+    filenames = expand_file_patterns(args.files)
+    extension, _, header, separator, footer = EXPORT_FORMATS[args.format]
+    output = args.output or "export" + extension
+    part_dir = tempfile.mkdtemp(prefix=".export-", dir=os.path.dirname(os.path.abspath(output)))
+    part_filenames = [os.path.join(part_dir, f"{i}.part") for i in range(len(filenames))]
+    total = 0
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor, \
+                open(output + ".tmp", 'w', encoding='utf-8', newline='') as out:
+            out.write(header)
+            # map() yields in input order, so parts are appended deterministically as soon as they are ready.
+            counts = executor.map(export_file_part, filenames, itertools.repeat(args.format), part_filenames)
+            for filename, part_filename, count in zip(filenames, part_filenames, counts):
+                if count:
+                    if total:
+                        out.write(separator)
+                    with open(part_filename, 'r', encoding='utf-8', newline='') as part:
+                        shutil.copyfileobj(part, out)
+                    total += count
+                os.remove(part_filename)
+                logger.debug(f"Exported {count} records from {filename}")
+            out.write(footer)
+        os.replace(output + ".tmp", output)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+    logger.info(f"Exported {total} records from {len(filenames)} files to {output}")
+    return total
+
+
+def read_term_file(filename):
+    """The search terms in a term file, as written.
+
+    Files with an "#OR" header list one phrase per line; other files hold boolean query text, from
+    which quoted phrases and bare words (other than AND/OR/NOT) are taken.
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    one_per_line = any(line.strip().upper() == "#OR" for line in lines)
+    phrases = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if one_per_line:
+            phrases.append(re.sub(r'\s+OR$', '', line.strip("()")).strip().strip('"'))
+        else:
+            for quoted, word in re.findall(r'"([^"]+)"|([^\s()"]+)', line):
+                if quoted or word.upper() not in ("AND", "OR", "NOT"):
+                    phrases.append(quoted or word)
+    return [phrase for phrase in phrases if phrase]
+
+
+def load_concept_groups(filenames):
+    """Read search term files into {group name (file stem): [normalised phrases]}."""
+    groups = {}
+    for filename in filenames:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        groups[name] = sorted({rank_text(phrase) for phrase in read_term_file(filename)} - {""})
+    return groups
+
+
+# Cheaper than normalise_title()'s regex on long abstracts; punctuation (ASCII and general) becomes a space.
+RANK_PUNCTUATION = str.maketrans({c: " " for c in "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~\u00a0\u2010\u2011\u2012\u2013\u2014\u2018\u2019\u201c\u201d\u2026"})
+
+
+def rank_text(text):
+    return " ".join(text.lower().translate(RANK_PUNCTUATION).split())
+
+
+def match_phrases(text, unigrams, phrase_starts):
+    """Yield (phrase, count) for the concept phrases occurring in `text` (as returned by rank_text())."""
+    tokens = set(text.split(" "))
+    padded = f" {text} "
+    for token in tokens & unigrams:
+        yield token, padded.count(f" {token} ")
+    for token in tokens & phrase_starts.keys():
+        for phrase in phrase_starts[token]:
+            count = padded.count(f" {phrase} ")
+            if count:
+                yield phrase, count
+
+
+def rank_file_counts(filename, vocabulary, unigrams, phrase_starts):
+    """Concept phrase counts of every record in one result file (runs in a worker process).
+
+    Returns (publication id, title, year) per record and the (row, phrase, count) triplets and
+    token lengths the sparse document matrix is built from.
+    """
+    infos, rows, cols, counts, lengths = [], [], [], [], []
+    for _, results in iter_result_file(filename):
+        for result in results:
+            title = get_field(result, "title")
+            text = rank_text(f"{title or ''} {get_field(result, 'abstract') or ''}")
+            for phrase, count in match_phrases(text, unigrams, phrase_starts):
+                rows.append(len(infos))
+                cols.append(vocabulary[phrase])
+                counts.append(count)
+            lengths.append(text.count(" ") + 1)
+            infos.append((publication_id(result), title, get_field(result, "year")))
+    return infos, rows, cols, counts, lengths
+
+
+def run_rank(args):
+    try:
+        import numpy as np
+        import scipy.sparse
+    except ImportError:
+        logger.error("rank requires numpy and scipy (pip install numpy scipy).")
+        return
+    groups = load_concept_groups(expand_file_patterns(args.terms))
+    group_names = list(groups)
+    vocabulary = {}
+    for phrases in groups.values():
+        for phrase in phrases:
+            vocabulary.setdefault(phrase, len(vocabulary))
+    unigrams = {phrase for phrase in vocabulary if " " not in phrase}
+    phrase_starts = collections.defaultdict(list)
+    for phrase in vocabulary:
+        if " " in phrase:
+            phrase_starts[phrase.split(" ", 1)[0]].append(phrase)
+
+    # Sparse document x phrase term counts, one row per unique publication (its first occurrence).
+    rows, cols, counts, lengths, records, seen = [], [], [], [], [], set()
+    count_file = functools.partial(rank_file_counts, vocabulary=vocabulary, unigrams=unigrams,
+                                   phrase_starts=dict(phrase_starts))
+    filenames = expand_file_patterns(args.files)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 \
+            else contextlib.nullcontext() as executor:
+        for filename, (infos, file_rows, file_cols, file_counts, file_lengths) in \
+                zip(filenames, (executor.map if executor else map)(count_file, filenames)):
+            row_map = np.full(len(infos), -1, dtype=np.int64)
+            for local, info in enumerate(infos):
+                if info[0] not in seen:
+                    seen.add(info[0])
+                    row_map[local] = len(records)
+                    records.append(info + (filename,))
+            file_rows = row_map[np.array(file_rows, dtype=np.int64)]
+            keep = file_rows >= 0
+            rows.append(file_rows[keep])
+            cols.append(np.array(file_cols, dtype=np.int64)[keep])
+            counts.append(np.array(file_counts, dtype=np.float64)[keep])
+            lengths.append(np.array(file_lengths, dtype=np.float64)[row_map >= 0])
+    n = len(records)
+    if n == 0:
+        logger.error("No results found.")
+        return
+    rows, cols, tf, lengths = (np.concatenate(parts) for parts in (rows, cols, counts, lengths))
+    df = np.bincount(cols, minlength=len(vocabulary))
+    if args.scheme == "bm25":
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        norm = args.k1 * (1 - args.b + args.b * lengths[rows] / max(lengths.mean(), 1))
+        weights = idf[cols] * tf * (args.k1 + 1) / (tf + norm)
+    else:
+        idf = np.log((n + 1) / (df + 1)) + 1
+        weights = idf[cols] * (1 + np.log(tf))
+    matrix = scipy.sparse.csr_matrix((weights, (rows, cols)), shape=(n, len(vocabulary)))
+    membership = scipy.sparse.csr_matrix(
+        (np.ones(sum(map(len, groups.values()))),
+         ([vocabulary[phrase] for phrases in groups.values() for phrase in phrases],
+          [g for g, phrases in enumerate(groups.values()) for _ in phrases])),
+        shape=(len(vocabulary), len(groups)))
+
+    group_scores = (matrix @ membership).toarray()
+    coverage = (group_scores > 0).sum(axis=1)
+    score = group_scores.sum(axis=1)
+    order = np.lexsort((-score, -coverage))  # most concept groups covered first, then strongest match
+    if args.top:
+        order = order[:args.top]
+    group_scores, coverage, score = group_scores[order].round(4).tolist(), coverage[order].tolist(), score[order].round(4).tolist()
+    write_csv(args.output, ["rank", "id", "title", "year", "coverage", "score"] + group_names + ["file"],
+              ([rank + 1, *records[i][:3], coverage[rank], score[rank], *group_scores[rank], records[i][3]]
+               for rank, i in enumerate(order.tolist())))
+    logger.info(f"Ranked {n} publications against {len(groups)} concept groups ({len(vocabulary)} phrases); "
+                f"{coverage.count(len(groups))} of the {len(order)} written cover every group. Written to {args.output}")
+
+
+def sweep_query(terms, extra=None):
+    """Scholar query text for a sweep group: the terms OR-ed together (AND-ed with `extra`, if any)."""
+    query = " OR ".join(f'"{term}"' for term in terms)
+    if extra:
+        query = f"({query}) {extra}" if len(terms) > 1 else f"{query} {extra}"
+    return query
+
+
+def sweep_url_length(query, year_low=None, year_high=None, limit=SCHOLAR_PAGE_SIZE):
+    """Length of the longest result page url scholarly builds for `query` (its last page within `limit`)."""
+    # As search_pubs(): requests.utils.quote() is urllib.parse.quote(), so a space becomes %20.
+    path = f"/scholar?hl=en&q={urllib.parse.quote(query)}"
+    start_index = (max(limit, 1) - 1) // SCHOLAR_PAGE_SIZE * SCHOLAR_PAGE_SIZE
+    if hasattr(scholarly, "_construct_url"):
+        path = scholarly._construct_url(path, patents=False, citations=False, year_low=year_low,
+                                        year_high=year_high, start_index=start_index)
+    else:
+        path += "".join(f"&{key}={value}" for key, value in (("as_ylo", year_low), ("as_yhi", year_high))
+                        if value is not None) + "&as_vis=1&as_sdt=1,33" + (f"&start={start_index}" if start_index else "")
+    return len(SCHOLAR_HOST + path)
+
+
+def coalesce_terms(terms, extra=None, max_url_length=2048, max_terms=20, **url_options):
+    """Pack terms, in order, into as few OR queries as fit `max_url_length` and `max_terms`.
+
+    `url_options` (year_low, year_high, limit) are passed on to sweep_url_length().
+    """
+    groups, group = [], []
+    for term in terms:
+        if group and (len(group) >= max_terms or
+                      sweep_url_length(sweep_query(group + [term], extra), **url_options) > max_url_length):
+            groups.append(group)
+            group = []
+        group.append(term)
+    if group:
+        groups.append(group)
+    return groups
+
+
+def attribute_result(result, phrases):
+    """The terms (keys of `phrases`, term -> rank_text phrase) found in a result's title and snippet."""
+    text = f" {rank_text(' '.join(filter(None, (get_field(result, 'title'), get_field(result, 'abstract')))))} "
+    return [term for term, phrase in phrases.items() if phrase and f" {phrase} " in text]
+
+
+def run_sweep(args):
+    """Search each term of the term files, optionally coalescing small queries into OR queries.
+
+    A coalesced query with more results than --limit is split in half and the halves are queried
+    again, so broad terms end up in queries of their own. Results of a coalesced query are attributed
+    back to its terms by matching the terms against the title and snippet; results matching several
+    terms (or none) and terms whose query was truncated by --limit are reported as uncertain.
+    """
+    year_low = year_high = None
+    if args.date:
+        try:
+            year_low, year_high = parse_date_range(args.date)
+        except ValueError:
+            logger.error("Invalid date format. Please use year, year-, -year or year_low-year_high format.")
+            return
+    terms = list(dict.fromkeys(term for filename in expand_file_patterns(args.terms) for term in read_term_file(filename)))
+    if not terms:
+        logger.error("No search terms found.")
+        return
+    if args.coalesce:
+        groups = coalesce_terms(terms, args.with_terms, args.max_url_length, args.max_terms,
+                                year_low=year_low, year_high=year_high, limit=args.limit)
+    else:
+        groups = [[term] for term in terms]
+    for group in groups:
+        if sweep_url_length(sweep_query(group, args.with_terms), year_low, year_high, args.limit) > args.max_url_length:
+            logger.warning(f"The query for {group[0]!r} alone exceeds --max-url-length {args.max_url_length}")
+    logger.info(f"Sweeping {len(terms)} terms with {len(groups)} queries")
+
+    getproxy(args)
+    start_time = gettime()
+    records, report, queries = [], [], []
+    pending = collections.deque(groups)
+    while pending:
+        group = pending.popleft()
+        query = sweep_query(group, args.with_terms)
+        phrases = {term: rank_text(term) for term in group}
+        counts = collections.Counter()
+        shared = collections.Counter()
+        try:
+            search_results = scholarly.search_pubs(query, patents=False, citations=False,
+                                                   year_low=year_low, year_high=year_high)
+            total = get_results_count(search_results)
+            if len(group) > 1 and total is not None and total > args.limit:
+                # Too broad to merge: only the first page was fetched; query the halves instead.
+                half = len(group) // 2
+                pending.extendleft([group[half:], group[:half]])
+                queries.append({"query": query, "terms": group, "resultsAvailable": total, "split": True})
+                logger.info(f"{total} results for {len(group)} coalesced terms exceed --limit {args.limit}; splitting")
+                continue
+            results = [record_to_dict(result) for result in itertools.islice(search_results, args.limit)]
+        except Exception as e:
+            logger.error(f"Query {query!r} failed: {e}")
+            queries.append({"query": query, "terms": group, "error": str(e)})
+            report.extend([term, query, "", "", "", "", "", "", "query failed"] for term in group)
+            continue
+        unattributed = 0
+        for result in results:
+            matched = attribute_result(result, phrases) if len(group) > 1 else list(group)
+            result["sweepQuery"] = query
+            result["matchedTerms"] = matched
+            counts.update(matched)
+            if len(matched) > 1:
+                shared.update(matched)
+            unattributed += not matched
+            records.append(result)
+        truncated = total is not None and total > len(results)
+        queries.append({"query": query, "terms": group, "resultsAvailable": total,
+                        "totalResultsRetrieved": len(results), "unattributed": unattributed})
+        for term in group:
+            notes = []
+            if len(group) > 1 and truncated and not counts[term]:
+                notes.append("no match among the retrieved results; other terms may have crowded it out")
+            elif len(group) > 1 and truncated:
+                notes.append("count is a lower bound; the query was truncated by --limit")
+            if shared[term]:
+                notes.append(f"{shared[term]} results also match other terms")
+            if unattributed:
+                notes.append(f"{unattributed} results of the query match no term in their snippet")
+            report.append([term, query, counts[term], shared[term], total, len(results), unattributed,
+                           len(group), "; ".join(notes)])
+
+    meta = {
+        "version": "OpenDevEd_jsonUploaderV01",
+        "source": "Google Scholar",
+        "sourceFormat": "original",
+        "date": gettime(),
+        "start_time": start_time,
+        "end_time": gettime(),
+        "filters": {"dateFrom": year_low, "dateTo": year_high},
+        "totalResultsRetrieved": len(records),
+        "sweep": {"terms": len(terms), "coalesce": args.coalesce, "with": args.with_terms, "queries": queries},
+        "args": vars(args),
+    }
+    write_results_stream(meta, records, f"{args.save}.json")
+    write_csv(f"{args.save}.sweep.csv", ["term", "query", "results", "shared", "query_available", "query_retrieved",
+                                        "query_unattributed", "query_terms", "uncertainty"], report)
+    ambiguous = sum(len(record["matchedTerms"]) > 1 for record in records)
+    unattributed = sum(not record["matchedTerms"] for record in records)
+    splits = sum(1 for query in queries if query.get("split"))
+    logger.info(f"Swept {len(terms)} terms with {len(queries)} queries ({splits} split for exceeding --limit); "
+                f"{len(records)} results written to {args.save}.json, per-term report in {args.save}.sweep.csv")
+    if ambiguous or unattributed:
+        logger.warning(f"Attribution is uncertain for {ambiguous} results matching several terms and "
+                       f"{unattributed} results matching none; see the uncertainty column of {args.save}.sweep.csv")
+
+
+def queue_merge(args):
+    results_dir = os.path.join(args.queue_dir, "results")
+    filenames = sorted(os.path.join(dirpath, f)
+                       for dirpath, _, files in os.walk(results_dir)
+                       for f in files if f.endswith('.json'))
+    merge_result_files(filenames, args.output)
+
+
+def run_command(args, exit_on_hang=True):
+    """Run a parsed command; long-lived callers pass exit_on_hang=False (see run_search())."""
+    if args.command == 'config':
+        api_key = ask_for_api_key()
+        logger.info(f"API key saved to {api_key_file}")
+        return
+
+    # process all other options here.
+
+    if args.command == 'fill':
+        return run_fill(args)
+
+    if args.command == 'download':
+        return run_download(args)
+
+    if args.command == 'dedupe':
+        return run_dedupe(args)
+
+    if args.command == 'analyze':
+        return run_analyze(args)
+
+    if args.command == 'serve':
+        return run_serve(args)
+
+    if args.command == 'sweep':
+        return run_sweep(args)
+
+    if args.command == 'rank':
+        return run_rank(args)
+
+    if args.command == 'export':
+        return run_export(args)
+
+    if args.command == 'get':
+        return run_get(args)
+
+    if args.command == 'refresh':
+        return run_refresh(args)
+
+    if args.command == 'merge':
+        return run_merge(args)
+
+    if args.command == 'queue':
+        if args.queue_command == 'add':
+            return queue_add(args)
+        if args.queue_command == 'status':
+            return queue_status(args)
+        if args.queue_command == 'merge':
+            return queue_merge(args)
+        logger.error("Please use queue add, queue status or queue merge.")
+        return
+
+    if args.command == 'worker':
+        return run_worker(args)
+
+    if args.command != "search":
+        logger.error("Please valid argument.")
+        return
+
+    return run_search(args, exit_on_hang=exit_on_hang)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    configure_logging(args)
+    status = run_command(args)
+    if args.command == 'get':
+        sys.exit(status)  # 1 when no record matched, for scripts.
+
+
 if __name__ == "__main__":
     main()
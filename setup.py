@@ -2,6 +2,9 @@ from setuptools import setup
 setup(
     name='scholarly-cli',
     version='0.0.1',
+    extras_require={
+        'analysis': ['numpy', 'scipy']
+    },
     entry_points={
         'console_scripts': [
             'scholarly-cli=scholarly_cli:main'